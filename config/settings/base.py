@@ -82,6 +82,7 @@ THIRD_PARTY_APPS = [
 
 LOCAL_APPS = [
     "dquora.users.apps.UsersConfig",
+    "dquora.tags.apps.TagsConfig",
     "dquora.news.apps.NewsConfig",
     "dquora.articles.apps.ArticlesConfig",
     "dquora.qa.apps.QaConfig",
@@ -286,6 +287,17 @@ CELERY_TASK_TIME_LIMIT = 5 * 60  # 任务最大运行时间
 CELERY_TASK_SOFT_TIME_LIMIT = 60  # 任务软时间限制，超出了就抛异常
 # http://docs.celeryproject.org/en/latest/userguide/configuration.html#beat-scheduler
 # CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+# http://docs.celeryproject.org/en/latest/userguide/periodic-tasks.html#beat-entries
+CELERY_BEAT_SCHEDULE = {
+    "reconcile-tag-counts": {
+        "task": "dquora.taskapp.tasks.reconcile_tag_counts",
+        "schedule": 60 * 60,  # 每小时根据TaggedItem校准一次标签统计
+    },
+    "compact-notifications": {
+        "task": "dquora.notifications.tasks.compact_notifications",
+        "schedule": 24 * 60 * 60,  # 每天清理一次超过保留期的已读通知
+    },
+}
 
 # django-allauth
 # ------------------------------------------------------------------------------
@@ -321,3 +333,12 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# WebSocket事件合并广播的窗口期（秒）与进程内最多缓存的事件数，见dquora/notifications/broadcast.py
+NOTIFICATIONS_BROADCAST_WINDOW = env.float("NOTIFICATIONS_BROADCAST_WINDOW", default=0.2)
+NOTIFICATIONS_BROADCAST_MAX_PENDING = env.int("NOTIFICATIONS_BROADCAST_MAX_PENDING", default=10000)
+# 通知是否在事务提交后交给Celery异步创建和推送，见dquora/notifications/views.py的send_notifications
+NOTIFICATIONS_ASYNC = env.bool("NOTIFICATIONS_ASYNC", default=True)
+# 已读通知的保留天数，每次清理最多删除的批数（每批1000条）
+NOTIFICATIONS_RETENTION_DAYS = env.int("NOTIFICATIONS_RETENTION_DAYS", default=90)
+NOTIFICATIONS_COMPACT_MAX_BATCHES = env.int("NOTIFICATIONS_COMPACT_MAX_BATCHES", default=100)
@@ -39,3 +39,5 @@ EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+NOTIFICATIONS_BROADCAST_WINDOW = 0  # 测试时立即发送，不启动后台线程
+NOTIFICATIONS_ASYNC = False  # 测试时同步创建通知
@@ -5,7 +5,9 @@ from django.conf import settings
 from slugify import slugify
 from taggit.managers import TaggableManager
 from markdownx.models import MarkdownxField
-from markdownx.utils import markdownify
+
+from dquora.helpers import MarkdownContentModel
+from dquora.tags.models import TagCount, register_tag_counts
 
 
 class ArticleQuerySet(models.query.QuerySet):
@@ -19,22 +21,13 @@ class ArticleQuerySet(models.query.QuerySet):
         """获取草稿箱的文章"""
         return self.filter(status='D')
 
-    def get_counted_tags(self):
+    def get_counted_tags(self, limit=None, min_count=1):
         """统计所有已发表的文章中， 每一个标签的数量（大于0的）"""
-        tag_dict = {}
-        # filter()里的tags应该用tagged别名把，这个地方写的有问题？？？
-        query = self.get_published().annotate(tagged=models.Count('tags')).filter(tags__gt=0)
-        for obj in query:
-            for tag in obj.tags.names():
-                if tag not in tag_dict:
-                    tag_dict[tag] = 1
-                else:
-                    tag_dict[tag] += 1
-        return tag_dict.items()
+        return TagCount.objects.popular(self.model, limit=limit, min_count=min_count)
 
 
 # Create your models here.
-class Article(models.Model):
+class Article(MarkdownContentModel):
     STATUS = (('D', 'Draft'), ('P', 'Published'))
     title = models.CharField(max_length=255, unique=True, verbose_name='标题')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL,
@@ -65,6 +58,5 @@ class Article(models.Model):
         self.slug = slugify(self.title)
         super(Article, self).save()
 
-    def get_markdown(self):
-        """将Markdown文本转换为html"""
-        return markdownify(self.content)
+
+register_tag_counts(Article, status='P')  # 热门标签只统计已发表的文章
@@ -7,6 +7,7 @@ from django_comments.signals import comment_was_posted
 
 from dquora.articles.models import Article
 from dquora.articles.forms import ArticleForm
+from dquora.tags.models import TagCount
 from dquora.helpers import AuthorRequiredMixin
 from dquora.notifications.views import notification_handler
 
@@ -23,7 +24,7 @@ class ArticleListView(ListView):
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(ArticleListView, self).get_context_data()
-        context['popular_tags'] = Article.objects.get_counted_tags()
+        context['popular_tags'] = TagCount.objects.popular(Article)
         return context
 
     def get_queryset(self):
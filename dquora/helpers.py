@@ -1,8 +1,22 @@
+import base64
+import hashlib
+import json
+from html import unescape
 from functools import wraps
 
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponseBadRequest, Http404
 from django.views.generic import View
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models
+from django.db.models import Q
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+from markdownx.utils import markdownify
+
+# Markdown渲染规则（markdownx扩展、过滤规则等）变化时加一，已缓存的HTML随之失效
+MARKDOWN_RENDER_VERSION = 1
+EXCERPT_LENGTH = 100  # 列表页摘要的字数
 
 
 def ajax_required(f):
@@ -30,3 +44,108 @@ class AuthorRequiredMixin(View):
             raise PermissionDenied
         return super(AuthorRequiredMixin, self).dispatch(request, *args, **kwargs)
 
+
+class KeysetPaginationMixin(object):
+    """
+    游标（keyset）分页，用于无限滚动的ListView：按(排序字段, 主键)降序定位下一页，
+    不使用OFFSET，也不统计总数。模板中用next_cursor生成“加载更多”的链接
+    """
+    paginate_by = 20
+    cursor_param = 'cursor'
+    keyset = ('created_at', 'pk')  # (排序字段, 唯一的次排序字段)，均按降序
+
+    def _keyset_fields(self, model):
+        return [model._meta.pk if name == 'pk' else model._meta.get_field(name) for name in self.keyset]
+
+    def encode_cursor(self, obj):
+        """把一页最后一条记录的排序值编码为不透明的游标"""
+        values = [field.value_to_string(obj) for field in self._keyset_fields(type(obj))]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, model, cursor):
+        """解码encode_cursor()生成的游标，格式不对时返回404"""
+        fields = self._keyset_fields(model)
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            # encode_cursor()生成的是与keyset等长的字符串列表
+            if not isinstance(values, list) or len(values) != len(fields) or \
+                    not all(isinstance(value, str) for value in values):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise Http404('无效的分页游标')
+
+    def paginate_queryset(self, queryset, page_size):
+        order_field, tie_field = self.keyset
+        queryset = queryset.order_by(f'-{order_field}', f'-{tie_field}')
+        cursor = self.request.GET.get(self.cursor_param)
+        if cursor:
+            value, tie = self.decode_cursor(queryset.model, cursor)
+            queryset = queryset.filter(
+                Q(**{f'{order_field}__lt': value}) | Q(**{order_field: value, f'{tie_field}__lt': tie}))
+        # 多取一条判断是否还有下一页
+        object_list = list(queryset[:page_size + 1])
+        has_next = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        self.next_cursor = self.encode_cursor(object_list[-1]) if has_next else None
+        return None, None, object_list, has_next
+
+    def get_context_data(self, **kwargs):
+        context = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        context['next_cursor'] = getattr(self, 'next_cursor', None)
+        return context
+
+
+def markdown_hash(content):
+    """Markdown内容加渲染版本的摘要，用于判断缓存的HTML是否过期"""
+    return hashlib.md5(f'{MARKDOWN_RENDER_VERSION}:{content}'.encode('utf-8')).hexdigest()
+
+
+def render_markdown(content):
+    """
+    渲染Markdown
+    :param content: Markdown文本
+    :return:        (HTML, 纯文本摘要, 内容摘要)
+    """
+    html = markdownify(content)
+    text = ' '.join(unescape(strip_tags(html)).split())
+    return html, Truncator(text).chars(EXCERPT_LENGTH), markdown_hash(content)
+
+
+class MarkdownContentModel(models.Model):
+    """
+    缓存Markdown内容（content字段）渲染后的HTML和纯文本摘要，保存时按内容摘要判断是否需要重新渲染。
+    子类需要定义content字段
+    """
+    content_html = models.TextField(blank=True, editable=False, verbose_name='内容HTML')
+    excerpt = models.CharField(max_length=255, blank=True, editable=False, verbose_name='摘要')
+    content_hash = models.CharField(max_length=32, blank=True, editable=False, verbose_name='内容摘要')
+
+    class Meta:
+        abstract = True
+
+    def markdown_is_fresh(self):
+        return bool(self.content_hash) and self.content_hash == markdown_hash(self.content)
+
+    def refresh_markdown(self):
+        """内容或渲染规则变化时重新渲染，返回是否有更新"""
+        if self.markdown_is_fresh():
+            return False
+        self.content_html, self.excerpt, self.content_hash = render_markdown(self.content)
+        return True
+
+    def save(self, *args, **kwargs):
+        self.refresh_markdown()
+        super(MarkdownContentModel, self).save(*args, **kwargs)
+
+    def get_markdown(self):
+        """将Markdown文本转换为html，优先使用缓存"""
+        if self.markdown_is_fresh():
+            return self.content_html
+        return markdownify(self.content)
+
+    def get_excerpt(self):
+        """列表页显示的纯文本摘要"""
+        if self.markdown_is_fresh():
+            return self.excerpt
+        return render_markdown(self.content)[1]
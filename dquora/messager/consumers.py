@@ -1,9 +1,8 @@
-import json
-from channels.generic.websocket import AsyncWebsocketConsumer
+from dquora.websocket import ProtocolConsumer
 
 
-class MessagesConsumer(AsyncWebsocketConsumer):
-    """处理私信应用中Websocket 请求"""
+class MessagesConsumer(ProtocolConsumer):
+    """处理私信应用中Websocket 请求，帧格式见dquora/websocket.py"""
 
     async def connect(self):
         if self.scope['user'].is_anonymous:
@@ -11,13 +10,16 @@ class MessagesConsumer(AsyncWebsocketConsumer):
             await self.close()
         else:
             # 加入聊天组(组名，频道名), self.channel_name自动生成频道，也可自定义
-            await self.channel_layer.group_add(self.scope['user'].username, self.channel_name)
+            # 新私信、已读回执都发到该组，断线重连后可补发
+            self.stream = self.scope['user'].username
+            await self.channel_layer.group_add(self.stream, self.channel_name)
             await self.accept()
-
-    async def receive(self, text_data=None, bytes_data=None):
-        """接受私信"""
-        await self.send(text_data=json.dumps(text_data))
+            await self.start_protocol()
 
     async def disconnect(self, code):
         """离开聊天组"""
-        await self.channel_layer.group_discard(self.scope['user'].username, self.channel_name)
+        try:
+            await super(MessagesConsumer, self).disconnect(code)
+        finally:
+            if self.stream is not None:
+                await self.channel_layer.group_discard(self.stream, self.channel_name)
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+def backfill_conversation(apps, schema_editor):
+    """按已有私信的收发双方生成会话标识"""
+    Message = apps.get_model('messager', 'Message')
+    pairs = Message.objects.filter(sender__isnull=False, recipient__isnull=False).values_list(
+        'sender_id', 'recipient_id').distinct().order_by()
+    for sender_id, recipient_id in pairs.iterator():
+        low, high = sorted((sender_id, recipient_id))
+        Message.objects.filter(sender_id=sender_id, recipient_id=recipient_id).update(conversation=f'{low}:{high}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.CharField(blank=True, editable=False, max_length=41, verbose_name='会话'),
+        ),
+        migrations.RunPython(backfill_conversation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+        ),
+    ]
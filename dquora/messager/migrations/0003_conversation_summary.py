@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:54
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def backfill_conversations(apps, schema_editor):
+    """根据已有私信生成会话摘要"""
+    Message = apps.get_model('messager', 'Message')
+    Conversation = apps.get_model('messager', 'Conversation')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    keys = Message.objects.exclude(conversation='').values_list('conversation', flat=True).distinct().order_by()
+    for key in keys.iterator():
+        messages = Message.objects.filter(conversation=key)
+        last = messages.order_by('-created_at').first()
+        low, high = (int(pk) for pk in key.split(':'))
+        existing = set(User.objects.filter(pk__in=(low, high)).values_list('pk', flat=True))  # 用户可能已被删除
+        unread = dict(messages.filter(unread=True).values_list('recipient_id').annotate(Count('pk')).order_by())
+        Conversation.objects.create(
+            key=key, user_low_id=low if low in existing else None, user_high_id=high if high in existing else None,
+            last_sender_id=last.sender_id,
+            last_message=(last.message or '')[:100], last_message_at=last.created_at,
+            low_unread=unread.get(low, 0), high_unread=unread.get(high, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messager', '0002_conversation_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=41, unique=True, verbose_name='会话')),
+                ('last_message', models.CharField(blank=True, max_length=255, verbose_name='最后一条消息')),
+                ('last_message_at', models.DateTimeField(verbose_name='最后一条消息时间')),
+                ('low_unread', models.PositiveIntegerField(default=0, verbose_name='未读数（主键较小的用户）')),
+                ('high_unread', models.PositiveIntegerField(default=0, verbose_name='未读数（主键较大的用户）')),
+                ('last_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='最后发送者')),
+                ('user_high', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='用户（主键较大）')),
+                ('user_low', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='用户（主键较小）')),
+            ],
+            options={
+                'verbose_name': '私信会话',
+                'verbose_name_plural': '私信会话',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user_low', 'last_message_at'], name='conversation_low_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user_high', 'last_message_at'], name='conversation_high_recent_idx'),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messager', '0003_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'unread'], name='message_unread_idx'),
+        ),
+    ]
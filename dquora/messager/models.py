@@ -1,33 +1,40 @@
 import uuid
 
-from django.db import models
-from django.contrib.auth import get_user_model
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.utils.text import Truncator
 from django.conf import settings
 
 
+PREVIEW_LENGTH = 100  # 收件箱中最后一条消息的预览长度
+
+
+def conversation_key(user_a, user_b):
+    """两个用户间私信会话的标识，与发送方向无关：两人的主键按升序拼接"""
+    low, high = sorted(getattr(user, 'pk', user) for user in (user_a, user_b))
+    return f'{low}:{high}'
+
+
 class MessageQuerySet(models.query.QuerySet):
     """自定义Message的QuerySet API"""
 
     def get_conversation(self, sender, recipient):
-        """用户间的私信会话"""
-        qs_one = self.filter(sender=sender, recipient=recipient)  # A发送给B的消息
-        qs_two = self.filter(sender=recipient, recipient=sender)  # B发送给A的消息
-        return qs_one.union(qs_two).order_by('created_at')  # 取并集后按时间排序,结果时QuerySet
-
-    def get_most_recent_conversation(self, recipient):
-        """获取最近一次私信互动的用户"""
-        try:
-            qs_sent = self.filter(sender=recipient)  # 当前登录用户发送的消息
-            qs_received = self.filter(recipient=recipient)  # 当前登录用户接收的消息
-            qs = qs_sent.union(qs_received).latest("created_at")  # 最后一条消息
-            if qs.sender == recipient:
-                # 如果登录用户有发送消息，返回消息的接收者
-                return qs.recipient
-            # 否则返回消息的发送者
-            return qs.sender
-        except self.model.DoesNotExist:
-            # 如果模型实例不存在，则返回当前用户
-            return get_user_model().objects.get(username=recipient.username)
+        """用户间的私信会话，按(conversation, created_at)索引范围扫描"""
+        return self.filter(conversation=conversation_key(sender, recipient)).order_by('created_at')
+
+    def mark_conversation_read(self, recipient, sender):
+        """
+        recipient打开与sender的会话：sender发来的未读私信用一条UPDATE全部标为已读，并清零会话摘要中的未读数
+        :return: 标为已读的私信数
+        """
+        count = self.filter(recipient=recipient, sender=sender, unread=True).update(unread=False)
+        if count:
+            Conversation.objects.mark_read(recipient, sender)
+        return count
+
+    def unread_count(self, recipient):
+        """用户未读私信的总数，使用(recipient, unread)索引"""
+        return self.filter(recipient=recipient, unread=True).count()
 
 
 class Message(models.Model):
@@ -41,17 +48,120 @@ class Message(models.Model):
     unread = models.BooleanField(default=True, verbose_name='是否未读')  # True未读
     created_at = models.DateTimeField(db_index=True, auto_now_add=True,
                                       verbose_name='创建时间')  # 没有updated_at，私信发送之后不能修改或撤回
+    # 双方主键按升序拼接，见conversation_key()，用户被删除后仍保留
+    conversation = models.CharField(max_length=41, blank=True, editable=False, verbose_name='会话')
     objects = MessageQuerySet.as_manager()
 
     class Meta:
         verbose_name = '私信'
         verbose_name_plural = verbose_name
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+            # 未读私信数、打开会话时批量标为已读
+            models.Index(fields=['recipient', 'unread'], name='message_unread_idx'),
+        ]
 
     def __str__(self):
         return self.message
 
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if not self.conversation and self.sender_id and self.recipient_id:
+            self.conversation = conversation_key(self.sender_id, self.recipient_id)
+        adding = self._state.adding
+        # 私信和会话摘要在同一事务中写入，摘要更新失败时私信也不保存
+        with transaction.atomic(using=using):
+            super(Message, self).save(force_insert, force_update, using, update_fields)
+            if adding and self.conversation:
+                Conversation.objects.record_message(self)
+
     def mark_as_read(self):
+        """标记单条私信已读，同时把接收者在会话摘要中的未读数减1"""
         if self.unread:
             self.unread = False
-            self.save()
+            if Message.objects.filter(pk=self.pk, unread=True).update(unread=False) and \
+                    self.sender_id and self.recipient_id:
+                Conversation.objects.mark_read(self.recipient_id, self.sender_id, count=1)
+
+
+class ConversationQuerySet(models.query.QuerySet):
+    """自定义Conversation的QuerySet API"""
+
+    def record_message(self, message):
+        """新私信：更新会话的最后一条消息，接收者一方的未读数加1，会话不存在时创建"""
+        low, high = sorted((message.sender_id, message.recipient_id))
+        unread_field = 'low_unread' if message.recipient_id == low else 'high_unread'
+        summary = {
+            'last_sender_id': message.sender_id,
+            'last_message': Truncator(message.message or '').chars(PREVIEW_LENGTH),
+            'last_message_at': message.created_at,
+        }
+        for attempt in range(2):
+            if self.filter(key=message.conversation).update(**summary, **{unread_field: F(unread_field) + 1}):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(key=message.conversation, user_low_id=low, user_high_id=high,
+                                **summary, **{unread_field: 1})
+                return
+            except IntegrityError:
+                # 另一个请求同时创建了该会话，重新更新一次；仍然失败时抛出，不让摘要与私信不一致
+                if attempt:
+                    raise
+
+    def inbox(self, user, limit=None):
+        """
+        用户的私信会话，按最后一条消息的时间倒序，一次查询
+        每个会话设置partner（对方用户）和unread（该用户的未读数）属性
+        """
+        qs = self.filter(Q(user_low=user) | Q(user_high=user)).select_related(
+            'user_low', 'user_high').order_by('-last_message_at')
+        conversations = list(qs[:limit] if limit else qs)
+        for conversation in conversations:
+            if conversation.user_low_id == user.pk:
+                conversation.partner, conversation.unread = conversation.user_high, conversation.low_unread
+            else:
+                conversation.partner, conversation.unread = conversation.user_low, conversation.high_unread
+        return conversations
+
+    def mark_read(self, user, partner, count=None):
+        """
+        用户阅读了与partner的会话中的私信，减少该用户一方的未读数
+        :param user:    阅读私信的用户或其主键
+        :param partner: 会话的对方用户或其主键
+        :param count:   已读的私信数，None表示打开了整个会话，未读数清零
+        """
+        user_id, partner_id = getattr(user, 'pk', user), getattr(partner, 'pk', partner)
+        unread_field = 'low_unread' if user_id < partner_id else 'high_unread'
+        qs = self.filter(key=conversation_key(user_id, partner_id))
+        if count is None:
+            return qs.exclude(**{unread_field: 0}).update(**{unread_field: 0})
+        return qs.filter(**{f'{unread_field}__gte': count}).update(**{unread_field: F(unread_field) - count})
+
+
+class Conversation(models.Model):
+    """两个用户间私信会话的摘要，每对用户一行，收件箱按最后一条消息时间排序"""
+    key = models.CharField(max_length=41, unique=True, verbose_name='会话')  # 同Message.conversation
+    user_low = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', blank=True, null=True,
+                                 on_delete=models.SET_NULL, verbose_name='用户（主键较小）')
+    user_high = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', blank=True, null=True,
+                                  on_delete=models.SET_NULL, verbose_name='用户（主键较大）')
+    last_sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', blank=True, null=True,
+                                    on_delete=models.SET_NULL, verbose_name='最后发送者')
+    last_message = models.CharField(max_length=255, blank=True, verbose_name='最后一条消息')  # 截断后的预览
+    last_message_at = models.DateTimeField(verbose_name='最后一条消息时间')
+    low_unread = models.PositiveIntegerField(default=0, verbose_name='未读数（主键较小的用户）')
+    high_unread = models.PositiveIntegerField(default=0, verbose_name='未读数（主键较大的用户）')
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '私信会话'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['user_low', 'last_message_at'], name='conversation_low_recent_idx'),
+            models.Index(fields=['user_high', 'last_message_at'], name='conversation_high_recent_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+from django.core.cache import cache
+
+from dquora import websocket
+from dquora.messager.consumers import MessagesConsumer
+
+
+@pytest.fixture
+def consumer():
+    """不经过频道层，直接调用协议方法，发出的帧记录在consumer.frames中"""
+    consumer = MessagesConsumer({'type': 'websocket'})
+    consumer.stream = f'test-{uuid.uuid4().hex}'  # 每个测试独立的序号
+    consumer.frames = []
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        consumer.frames.append(json.loads(text_data))
+
+    consumer.send = send
+    return consumer
+
+
+def hello(consumer, last_seq):
+    frame = json.dumps({'v': 1, 't': 'hello', 'd': {'last_seq': last_seq}})
+    asyncio.run(consumer.receive(text_data=frame))
+    frames, consumer.frames = consumer.frames, []
+    return frames
+
+
+def test_first_hello_gets_current_seq(consumer):
+    websocket.make_event(consumer.stream, 'message', {'n': 1}, resumable=True)
+    assert hello(consumer, None) == [{'v': 1, 't': 'welcome', 's': 1}]
+
+
+def test_resume_replays_missed_events(consumer):
+    for n in range(1, 4):
+        websocket.make_event(consumer.stream, 'message', {'n': n}, resumable=True)
+
+    frames = hello(consumer, 1)
+    assert frames[0]['t'] == 'batch'
+    assert [(event['s'], event['d']) for event in frames[0]['e']] == [(2, {'n': 2}), (3, {'n': 3})]
+    assert frames[1] == {'v': 1, 't': 'welcome', 's': 3}
+
+    # 没有错过的事件
+    assert hello(consumer, 3) == [{'v': 1, 't': 'welcome', 's': 3}]
+
+
+def test_resume_resets_when_events_cannot_be_replayed(consumer):
+    for n in range(1, 4):
+        websocket.make_event(consumer.stream, 'message', {'n': n}, resumable=True)
+
+    # 客户端的序号比服务端新（如缓存被清空）
+    assert hello(consumer, 9) == [{'v': 1, 't': 'reset', 's': 3}]
+    # 错过的事件已过期
+    cache.delete(websocket._event_key(consumer.stream, 2))
+    assert hello(consumer, 1) == [{'v': 1, 't': 'reset', 's': 3}]
+
+
+def test_disconnect_leaves_group_when_heartbeat_failed(consumer):
+    discarded = []
+
+    class ChannelLayer:
+        async def group_discard(self, group, channel):
+            discarded.append(group)
+
+    async def failing_heartbeat():
+        raise RuntimeError('发送失败')
+
+    async def run():
+        consumer.heartbeat = asyncio.ensure_future(failing_heartbeat())
+        await asyncio.sleep(0)
+        await consumer.disconnect(1000)
+
+    consumer.channel_layer = ChannelLayer()
+    consumer.channel_name = 'test-channel'
+    asyncio.run(run())
+    assert discarded == [consumer.stream]
@@ -0,0 +1,61 @@
+import pytest
+
+from dquora.messager.models import Conversation, Message, PREVIEW_LENGTH
+from dquora.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def unread_in_inbox(user):
+    return [(conversation.partner, conversation.unread) for conversation in Conversation.objects.inbox(user)]
+
+
+def test_messages_share_one_conversation_in_both_directions():
+    alice, bob = UserFactory(), UserFactory()
+    first = Message.objects.create(sender=alice, recipient=bob, message='你好')
+    reply = Message.objects.create(sender=bob, recipient=alice, message='你好呀')
+    assert first.conversation == reply.conversation
+    assert list(Message.objects.get_conversation(alice, bob)) == [first, reply]
+    assert list(Message.objects.get_conversation(bob, alice)) == [first, reply]
+
+
+def test_record_message_keeps_summary_and_unread_counts():
+    alice, bob, carol = UserFactory(), UserFactory(), UserFactory()
+    Message.objects.create(sender=alice, recipient=bob, message='1')
+    Message.objects.create(sender=bob, recipient=alice, message='2')
+    Message.objects.create(sender=bob, recipient=alice, message='长' * (PREVIEW_LENGTH * 2))
+    Message.objects.create(sender=carol, recipient=alice, message='3')
+
+    assert Conversation.objects.count() == 2
+    # 按最后一条消息时间倒序
+    assert unread_in_inbox(alice) == [(carol, 1), (bob, 2)]
+    assert unread_in_inbox(bob) == [(alice, 1)]
+    conversation = Conversation.objects.inbox(alice)[1]
+    assert conversation.last_sender == bob
+    assert len(conversation.last_message) == PREVIEW_LENGTH
+
+
+def test_mark_conversation_read_clears_only_the_readers_side():
+    alice, bob = UserFactory(), UserFactory()
+    for i in range(3):
+        Message.objects.create(sender=bob, recipient=alice, message=str(i))
+    Message.objects.create(sender=alice, recipient=bob, message='好的')
+
+    assert Message.objects.mark_conversation_read(alice, bob) == 3
+    assert Message.objects.unread_count(alice) == 0
+    assert Message.objects.unread_count(bob) == 1
+    assert unread_in_inbox(alice) == [(bob, 0)]
+    assert unread_in_inbox(bob) == [(alice, 1)]
+    # 没有新的未读私信时不再更新
+    assert Message.objects.mark_conversation_read(alice, bob) == 0
+
+
+def test_mark_as_read_decrements_once():
+    alice, bob = UserFactory(), UserFactory()
+    message = Message.objects.create(sender=bob, recipient=alice, message='1')
+    Message.objects.create(sender=bob, recipient=alice, message='2')
+
+    message.mark_as_read()
+    Message.objects.get(pk=message.pk).mark_as_read()
+    assert unread_in_inbox(alice) == [(bob, 1)]
+    assert Message.objects.unread_count(alice) == 1
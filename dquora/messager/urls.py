@@ -8,6 +8,7 @@ urlpatterns = [
     path('send-message/', views.send_message, name='send_message'),
     path('receive_message/', views.receive_message, name='receive_message'),
     path('<username>/', views.ConversationListView.as_view(), name='conversation_detail'),
+    path('<username>/older/', views.OlderMessagesView.as_view(), name='older_messages'),
 
 
 
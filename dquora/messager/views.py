@@ -1,54 +1,102 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
 from django.views.generic import ListView
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.decorators.http import require_http_methods
 from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from dquora.helpers import ajax_required
-from dquora.messager.models import Message
+from dquora.helpers import ajax_required, KeysetPaginationMixin
+from dquora.messager.models import Message, Conversation
+from dquora.websocket import make_event, publish
 
+INBOX_SIZE = 20  # 私信页显示的会话数
+MESSAGES_PAGE_SIZE = 30  # 每次显示/加载的私信数
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60  # 私信HTML片段的缓存时间，发送者修改头像、昵称后最多这么久更新
 
-class MessagesListView(LoginRequiredMixin, ListView):
-    """私信列表页"""
+
+class MessagesListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """私信列表页，只显示最近的一页消息，更早的消息通过OlderMessagesView加载"""
     model = Message
+    paginate_by = MESSAGES_PAGE_SIZE
+    keyset = ('created_at', 'uuid_id')
     template_name = 'messager/message_list.html'
 
+    def get_active_user(self):
+        """最近一次私信互动的用户，即收件箱中的第一个会话，没有私信时为当前用户"""
+        if self.conversations:
+            return self.conversations[0].partner or self.request.user
+        return self.request.user
+
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(MessagesListView, self).get_context_data()
-        # 获取除当前登录用户外的所有用户，按最近登录时间降序排列
+        # 游标分页按时间倒序取出最近的一页，聊天框中按时间正序显示
+        context['message_list'] = context['object_list'] = context['object_list'][::-1]
+        context['conversations'] = self.conversations
+        # 获取除当前登录用户外、还没有私信往来的用户，按最近登录时间降序排列
         # get_user_model()获取用户模型，is_active=True当前激活的用户
-        context['users_list'] = get_user_model().objects.filter(is_active=True).exclude(
-            username=self.request.user).order_by('-last_login')[:10]
-        # 最近一次私信互动的用户
-        last_conversation = Message.objects.get_most_recent_conversation(self.request.user)
-        context['active'] = last_conversation.username
+        partners = {conversation.partner.pk for conversation in self.conversations if conversation.partner}
+        context['users_list'] = [user for user in get_user_model().objects.filter(is_active=True).exclude(
+            username=self.request.user).order_by('-last_login')[:10] if user.pk not in partners]
+        context['active'] = self.active_user.username
+        context['unread_count'] = Message.objects.unread_count(self.request.user)
         return context
 
     def get_queryset(self):
         """最近私信互动的内容"""
-        active_user = Message.objects.get_most_recent_conversation(self.request.user)
-        return Message.objects.get_conversation(self.request.user, active_user)
+        # 收件箱：会话摘要按最后一条消息时间排序，一次查询
+        self.conversations = Conversation.objects.inbox(self.request.user, limit=INBOX_SIZE)
+        self.active_user = self.get_active_user()
+        if Message.objects.mark_conversation_read(self.request.user, self.active_user):
+            send_read_receipt(self.request.user, self.active_user)
+        return Message.objects.get_conversation(self.request.user, self.active_user).select_related('sender')
 
 
 class ConversationListView(MessagesListView):
     """与指定用户的私信内容"""
 
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super(ConversationListView, self).get_context_data()
-        # url.py中设置的username参数，表示指定的用户
-        context['active'] = self.kwargs["username"]
-        return context
+    def get_active_user(self):
+        # 获取URL中username参数指定的用户
+        return get_object_or_404(get_user_model(), username=self.kwargs["username"])
+
+
+@method_decorator(ajax_required, name='dispatch')
+class OlderMessagesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """加载与指定用户更早的私信，AJAX GET 请求，返回一页消息片段和下一页的游标"""
+    model = Message
+    paginate_by = MESSAGES_PAGE_SIZE
+    keyset = ('created_at', 'uuid_id')
+    http_method_names = ['get']
 
     def get_queryset(self):
-        # 获取URL中username参数指定的用户
-        active_user = get_object_or_404(get_user_model(),
-                                        username=self.kwargs["username"])
-        return Message.objects.get_conversation(self.request.user, active_user)
+        active_user = get_object_or_404(get_user_model(), username=self.kwargs["username"])
+        return Message.objects.get_conversation(self.request.user, active_user).select_related('sender')
+
+    def render_to_response(self, context, **response_kwargs):
+        # 游标分页按时间倒序取出，片段按时间正序拼接后插入到聊天框顶部
+        html = ''.join(render_message(message) for message in reversed(context['object_list']))
+        return JsonResponse({'messages': html, 'next_cursor': context['next_cursor']})
+
+
+def render_message(message):
+    """渲染一条私信的HTML片段并缓存，私信发送后不能修改，同一条私信只渲染一次"""
+    key = f'messager:fragment:{message.pk}'
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('messager/single_message.html', {'message': message})
+        cache.set(key, html, FRAGMENT_CACHE_TIMEOUT)
+    return html
+
+
+def send_read_receipt(reader, sender):
+    """reader已读sender发来的私信，事务提交后通过MessagesConsumer通知sender"""
+    data = {'by': reader.username}
+    transaction.on_commit(lambda: publish(sender.username, [make_event(sender.username, 'read', data, resumable=True)]))
 
 
 @login_required
@@ -62,18 +110,17 @@ def send_message(request):
     message = request.POST['message']
     if len(message.strip()) != 0 and sender != recipient:
         msg = Message.objects.create(sender=sender, recipient=recipient, message=message)
-        channel_layer = get_channel_layer()  # 获得频道层
-        # 数据字典
-        payload = {
-            'type': 'receive',  # 固定写法，表示使用consumer.py的receive方法
-            # 下面为传递的消息数据
-            'message': render_to_string('messager/single_message.html', {'message': msg}),
+        html = render_message(msg)  # 推送给接收者和返回给发送者的是同一个片段，只渲染一次
+        # 推送给接收者的数据，接收者直接插入片段，不需要再请求receive_message
+        data = {
+            'id': str(msg.pk),
+            'message': html,
             'sender': sender.username
         }
-        # consumer中异步函数变为同步
-        # 在频道层内，使用group_send(group所在组-接收者的username, message消息内容)往recipient_user_name组内发送数据payload
-        async_to_sync(channel_layer.group_send)(recipient_user_name, payload)
-        return render(request, 'messager/single_message.html', {'message': msg})
+        # 事务提交后发到接收者的组（组名为接收者的username），断线重连后可补发
+        transaction.on_commit(lambda: publish(
+            recipient_user_name, [make_event(recipient_user_name, 'message', data, resumable=True)]))
+        return HttpResponse(html)
     return HttpResponse()
 
 
@@ -83,5 +130,7 @@ def send_message(request):
 def receive_message(request):
     """接收消息， AJAX GET 请求"""
     message_id = request.GET['message_id']
-    msg = Message.objects.get(pk=message_id)
-    return render(request, 'messager/single_message.html', {'message': msg})
+    # 只能获取自己发送或接收的私信
+    msg = get_object_or_404(Message.objects.filter(Q(sender=request.user) | Q(recipient=request.user)),
+                            pk=message_id)
+    return HttpResponse(render_message(msg))
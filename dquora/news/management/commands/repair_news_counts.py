@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from dquora.news.models import News
+
+
+class Command(BaseCommand):
+    """根据点赞关系和评论重新计算首页动态的点赞数和评论数，用于修复计数偏差"""
+    help = '重新计算首页动态的点赞数（like_count）和评论数（comment_count）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批写回的记录数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # 两次分组查询得到全部计数，再只写回有偏差的记录
+        likes = dict(News.liked.through.objects.values_list('news_id').annotate(count=Count('pk')).order_by())
+        comments = dict(News.objects.filter(reply=True, parent__isnull=False).values_list('parent_id').annotate(
+            count=Count('pk')).order_by())
+        repaired = []
+        with transaction.atomic():
+            for news in News.objects.only('pk', 'like_count', 'comment_count').order_by().iterator():
+                like_count = likes.get(news.pk, 0)
+                comment_count = comments.get(news.pk, 0)
+                if news.like_count != like_count or news.comment_count != comment_count:
+                    news.like_count = like_count
+                    news.comment_count = comment_count
+                    repaired.append(news)
+            News.objects.bulk_update(repaired, ['like_count', 'comment_count'], batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'已修复{len(repaired)}条动态的点赞数和评论数'))
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['reply', 'created_at', 'uuid'], name='news_feed_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counts(apps, schema_editor):
+    """根据已有的点赞关系和评论初始化计数"""
+    News = apps.get_model('news', 'News')
+    likes = News.liked.through.objects.values_list('news_id').annotate(count=Count('pk')).order_by()
+    for news_id, count in likes.iterator():
+        News.objects.filter(pk=news_id).update(like_count=count)
+    comments = News.objects.filter(reply=True, parent__isnull=False).values_list('parent_id').annotate(
+        count=Count('pk')).order_by()
+    for parent_id, count in comments.iterator():
+        News.objects.filter(pk=parent_id).update(comment_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0002_feed_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='comment_count',
+            field=models.IntegerField(default=0, verbose_name='评论数'),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='like_count',
+            field=models.IntegerField(default=0, verbose_name='点赞数'),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,51 @@
-from django.db import models
+from django.db import models, transaction, connections, IntegrityError
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete
 from django.conf import settings
 import uuid
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-from dquora.notifications.views import notification_handler
+from dquora.notifications.views import notification_handler, notify_many
+from dquora.notifications.consumers import FEED_GROUP, news_group
+from dquora.notifications.broadcast import broadcaster
 
 
 # Create your models here.
 
+LIKERS_PREVIEW_LIMIT = 10  # 点赞按钮提示中最多显示的点赞用户数
+
+
+class NewsQuerySet(models.query.QuerySet):
+    """自定义News的QuerySet API"""
+
+    def set_like_info(self, user, news_list, preview=LIKERS_PREVIEW_LIMIT):
+        """
+        一页动态的点赞信息：当前用户是否点赞（一次查询）以及每条动态最近的preview个点赞用户，
+        分别写到liked_by_me和likers_preview属性上，不再逐条加载全部点赞用户
+        """
+        news_list = list(news_list)
+        for news in news_list:
+            news.liked_by_me = False
+            news.likers_preview = []
+        if not news_list:
+            return
+        by_id = {news.pk: news for news in news_list}
+        through = self.model.liked.through.objects
+        if user.is_authenticated:
+            for news_id in through.filter(user=user, news_id__in=by_id).values_list('news_id', flat=True):
+                by_id[news_id].liked_by_me = True
+        # 每条动态单独LIMIT，超级热门的动态也只取preview条
+        previews = [through.filter(news_id=news.pk).order_by('-pk').values_list('news_id', 'user__username')[:preview]
+                    for news in news_list if news.like_count]
+        if not previews:
+            return
+        if connections[self.db].features.supports_slicing_ordering_in_compound:
+            # UNION ALL合并为一次查询
+            rows = previews[0].union(*previews[1:], all=True)
+        else:
+            rows = (row for qs in previews for row in qs)
+        for news_id, username in rows:
+            by_id[news_id].likers_preview.append(username)
+
 
 class News(models.Model):
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -21,13 +57,20 @@ class News(models.Model):
     liked = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='liked_news',
                                    verbose_name='点赞用户')
     reply = models.BooleanField(default=False, verbose_name='是否为评论')
+    # 点赞数和评论数计数，由switch_like（其他地方增删点赞时由liked的m2m_changed信号）和reply_this同步维护，
+    # 可用repair_news_counts命令修复
+    like_count = models.IntegerField(default=0, verbose_name='点赞数')
+    comment_count = models.IntegerField(default=0, verbose_name='评论数')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    objects = NewsQuerySet.as_manager()
 
     class Meta:
         verbose_name = '首页'
         verbose_name_plural = verbose_name
         ordering = ("-created_at",)
+        # 首页动态按(created_at, uuid)游标分页
+        indexes = [models.Index(fields=['reply', 'created_at', 'uuid'], name='news_feed_keyset_idx')]
 
     def __str__(self):
         return self.content
@@ -37,26 +80,39 @@ class News(models.Model):
     # 没指定具体的一条数据（ Notification使用GenericForeignKey，所以New新建一条动态时，也会自动新建一条Notification实例）
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
+        adding = self._state.adding
         super(News, self).save()
-        if not self.reply:
-            # 仅给consumer传入数据用于通知‘notifications’组的其他用户们，不创建一条新Notification实例的
-            channel_layer = get_channel_layer()
+        if adding and not self.reply:
+            # 仅通知正在浏览首页动态的用户有新动态，不创建一条新Notification实例的
+            # 事务提交后才发送，窗口期内的多条新动态合并为一条提示
             payload = {
-                'type': 'receive',
                 'key': 'additional_news',
-                'actor_name': self.user.username
+                'actor_names': [self.user.username]
             }
-            async_to_sync(channel_layer.group_send)('notifications', payload)
+            transaction.on_commit(lambda: broadcaster.publish(FEED_GROUP, payload, merge_key='additional_news'))
 
     def switch_like(self, user):
-        """点赞或取消赞"""
-        # self.liked.all()表示给该条动态点赞的所有用户，而下面的remove()、add()是django关联对象的方法。
-        if user in self.liked.all():
-            self.liked.remove(user)
-        else:
-            self.liked.add(user)
+        """点赞或取消赞，完成后self.like_count、self.comment_count为最新值"""
+        # 直接增删点赞关系表的行，按实际变化的行数更新like_count，同一用户并发点击时计数也不会偏差。
+        # 不经过self.liked.add()/remove()，likes_changed只负责其他调用方
+        through = News.liked.through.objects
+        liked = False
+        with transaction.atomic():
+            delta = -through.filter(news_id=self.pk, user_id=user.pk).delete()[0]
+            if not delta:
+                try:
+                    with transaction.atomic():
+                        through.create(news_id=self.pk, user_id=user.pk)
+                    delta, liked = 1, True
+                except IntegrityError:
+                    pass  # 同一用户的并发请求刚点过赞，计数已由该请求更新
+            if delta:
+                News.objects.filter(pk=self.pk).update(like_count=F('like_count') + delta)
+        self.refresh_from_db(fields=['like_count', 'comment_count'])
+        self.broadcast_interactions()
+        if liked:
             # 新增点赞， 通知楼主（动态发布者）,新建了一条Notification实例
-            notification_handler(user, self.user, 'L', self, key='social_update', id_value=str(self.uuid))
+            notification_handler(user, self.user, 'L', self)
 
     def get_parent(self):
         """返回自关联中的上级记录或本身"""
@@ -75,14 +131,34 @@ class News(models.Model):
         :return:
         """
         parent = self.get_parent()
-        News.objects.create(
-            user=user,
-            content=text,
-            reply=True,
-            parent=parent
-        )
-        # 新增评论，通知楼主
-        notification_handler(user, parent.user, 'R', parent, key='social_update', id_value=str(parent.uuid))
+        with transaction.atomic():
+            News.objects.create(
+                user=user,
+                content=text,
+                reply=True,
+                parent=parent
+            )
+            News.objects.filter(pk=parent.pk).update(comment_count=F('comment_count') + 1)
+        parent.refresh_from_db(fields=['like_count', 'comment_count'])
+        parent.broadcast_interactions()
+        # 新增评论，一次批量通知楼主和之前参与评论的所有用户
+        participants = parent.thread.order_by().values_list('user_id', flat=True).distinct()
+        notify_many(user, [parent.user_id, *participants], 'R', parent)
+
+    def broadcast_interactions(self):
+        """
+        点赞数或评论数变化后，把最新计数推送给正在浏览该动态的客户端（事务提交后发送），
+        计数只在这里读取一次，客户端无需再请求/news/update-interactions/
+        """
+        payload = {
+            'key': 'social_update',
+            'id_value': str(self.uuid),
+            'likes': self.like_count,
+            'comments': self.comment_count
+        }
+        # 窗口期内同一条动态的多次变化只推送最新计数
+        transaction.on_commit(lambda: broadcaster.publish(news_group(self.uuid), payload,
+                                                          merge_key=payload['id_value']))
 
     def get_thread(self):
         """关联到当前记录的所有记录"""
@@ -91,14 +167,50 @@ class News(models.Model):
         # 上级记录(parent)下的子记录(thread)所有
         return parent.thread.all()
 
-    def comment_count(self):
-        """评论数"""
-        return self.get_thread().count()
-
     def count_likers(self):
         """点赞数"""
-        return self.liked.count()
+        return self.like_count
 
     def get_likers(self):
         """所有点赞用户"""
         return self.liked.all()
+
+
+def likes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    通过liked.add()/remove()/clear()等关联方法变化点赞时同步like_count，正向（news.liked）和
+    反向（user.liked_news）操作都会触发。switch_like直接写点赞关系表，自行维护计数，不经过这里
+    """
+    if action == 'pre_remove':
+        # remove()传入的对象不一定都点过赞，先取出真正存在的点赞关系
+        if reverse:
+            instance._unliked = list(instance.liked_news.filter(pk__in=pk_set).values_list('pk', flat=True))
+        else:
+            instance._unliked = list(instance.liked.filter(pk__in=pk_set).values_list('pk', flat=True))
+    elif action == 'pre_clear':
+        if reverse:
+            instance._unliked = list(instance.liked_news.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        ids = pk_set if action == 'post_add' else instance._unliked
+        delta = 1 if action == 'post_add' else -1
+        if not ids:
+            return
+        if reverse:
+            News.objects.filter(pk__in=ids).update(like_count=F('like_count') + delta)
+        else:
+            News.objects.filter(pk=instance.pk).update(like_count=F('like_count') + delta * len(ids))
+    elif action == 'post_clear':
+        if reverse:
+            News.objects.filter(pk__in=instance._unliked).update(like_count=F('like_count') - 1)
+        else:
+            News.objects.filter(pk=instance.pk).update(like_count=0)
+
+
+def reply_deleted(sender, instance, **kwargs):
+    """删除评论时扣减楼主动态的评论数"""
+    if instance.reply and instance.parent_id:
+        News.objects.filter(pk=instance.parent_id).update(comment_count=F('comment_count') - 1)
+
+
+m2m_changed.connect(receiver=likes_changed, sender=News.liked.through)
+post_delete.connect(receiver=reply_deleted, sender=News)
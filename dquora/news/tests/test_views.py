@@ -0,0 +1,55 @@
+import base64
+import json
+
+import pytest
+from django.http import Http404
+from django.test import RequestFactory
+
+from dquora.news.models import News
+from dquora.news.views import NewsListView
+
+pytestmark = pytest.mark.django_db
+
+
+def encode(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def paginate(rf: RequestFactory, user, params):
+    view = NewsListView()
+    view.request = rf.get('/news/', params)
+    view.request.user = user
+    object_list = view.paginate_queryset(view.get_queryset(), view.paginate_by)[2]
+    return object_list, view.next_cursor
+
+
+def test_feed_pages_cover_every_news_once(rf: RequestFactory, user):
+    for i in range(45):
+        News.objects.create(user=user, content=f'动态{i}')
+    News.objects.create(user=user, content='评论', reply=True)
+    # 同一时间发布的动态按uuid区分先后，不会在翻页时重复或遗漏
+    News.objects.update(created_at=News.objects.first().created_at)
+
+    pages = []
+    params = {}
+    while True:
+        object_list, cursor = paginate(rf, user, params)
+        pages.append([news.pk for news in object_list])
+        if cursor is None:
+            break
+        params = {'cursor': cursor}
+    assert [len(page) for page in pages] == [20, 20, 5]
+    seen = [pk for page in pages for pk in page]
+    assert seen == list(News.objects.filter(reply=False).order_by('-created_at', '-uuid').values_list('pk', flat=True))
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-base64!',
+    encode({'created_at': '2020-01-01'}),
+    encode(['2020-01-01 00:00:00']),
+    encode([None, None]),
+    encode(['2020-01-01 00:00:00', 'not-a-uuid']),
+])
+def test_feed_rejects_malformed_cursor(rf: RequestFactory, user, cursor):
+    with pytest.raises(Http404):
+        paginate(rf, user, {'cursor': cursor})
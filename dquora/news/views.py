@@ -6,21 +6,29 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.urls import reverse_lazy
 
-from dquora.news.models import News
-from dquora.helpers import ajax_required, AuthorRequiredMixin
+from dquora.news.models import News, LIKERS_PREVIEW_LIMIT
+from dquora.helpers import ajax_required, AuthorRequiredMixin, KeysetPaginationMixin
 
 
 # Create your views here.
 
 
-class NewsListView(LoginRequiredMixin, ListView):
-    """首页动态"""
+class NewsListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """首页动态，无限滚动使用游标分页"""
     model = News
     paginate_by = 20
+    keyset = ('created_at', 'uuid')
     template_name = 'news/news_list.html'
 
     def get_queryset(self):
-        return News.objects.filter(reply=False)
+        return News.objects.filter(reply=False).select_related('user')
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super(NewsListView, self).get_context_data(**kwargs)
+        # 当前页动态的点赞信息一次取出，模板中不再逐条加载全部点赞用户
+        News.objects.set_like_info(self.request.user, context['news_list'])
+        context['likers_preview_limit'] = LIKERS_PREVIEW_LIMIT
+        return context
 
 
 class NewsDeleteView(LoginRequiredMixin, AuthorRequiredMixin, DeleteView):
@@ -53,7 +61,7 @@ def like(request):
     news = News.objects.get(pk=news_id)
     user = request.user
     news.switch_like(user)
-    return JsonResponse({'likes': news.count_likers()})
+    return JsonResponse({'likes': news.like_count})
 
 
 @login_required
@@ -63,8 +71,10 @@ def get_thread(request):
     """返回动态的评论， AJAX GET 请求"""
     news_id = request.GET['news']
     news = News.objects.get(pk=news_id)
+    News.objects.set_like_info(request.user, [news])
     # 没有评论时显示该动态
-    news_html = render_to_string('news/news_single.html', {'news': news})
+    news_html = render_to_string('news/news_single.html', {'news': news, 'likers_preview_limit': LIKERS_PREVIEW_LIMIT},
+                                 request=request)
     # 有评论时，返回该动态下所有评论
     thread_html = render_to_string('news/news_thread.html', {'thread': news.get_thread()})
     return JsonResponse({
@@ -85,7 +95,7 @@ def post_comment(request):
     parent = News.objects.get(pk=parent_id)
     if text:
         parent.reply_this(request.user, text)
-        return JsonResponse({'comments': parent.comment_count()})
+        return JsonResponse({'comments': parent.get_parent().comment_count})
     else:
         return HttpResponseBadRequest('内容不能为空！')
 
@@ -96,5 +106,5 @@ def post_comment(request):
 def update_interactions(request):
     """点赞或评论的动作交互 引起的"""
     news_id = request.POST['id_value']
-    news = News.objects.get(pk=news_id)
-    return JsonResponse({'likes': news.count_likers(), 'comments': news.comment_count()})
+    counts = News.objects.filter(pk=news_id).values('like_count', 'comment_count').get()
+    return JsonResponse({'likes': counts['like_count'], 'comments': counts['comment_count']})
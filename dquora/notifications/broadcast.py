@@ -0,0 +1,152 @@
+"""
+WebSocket事件的合并、延迟广播
+
+短时间内发往同一组的事件先缓存在进程内，由后台线程每隔一个窗口期
+（settings.NOTIFICATIONS_BROADCAST_WINDOW秒）合并后对每个组只group_send一次，
+避免突发流量时逐条发送压垮Redis和客户端。窗口期为0时立即发送（测试环境）。
+发送的是dquora/websocket.py中定义的协议事件，一个组的多个事件由consumer合并为一帧。
+没有待发送的事件时后台线程阻塞等待，不轮询；统计信息每隔STATS_LOG_INTERVAL秒随发送写一次日志。
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+from dquora.websocket import make_event, publish
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_INTERVAL = 60  # 写统计日志的最短间隔（秒）
+
+
+def merge_events(old, new):
+    """合并merge_key相同的两个事件：列表类型的值取并集，其他值以新事件为准"""
+    merged = dict(old, **new)
+    for field, value in old.items():
+        if isinstance(value, list) and isinstance(new.get(field), list):
+            merged[field] = value + [item for item in new[field] if item not in value]
+    return merged
+
+
+class Broadcaster:
+    """按组缓存、合并事件并定时发送，同时统计批次大小、合并和丢弃的事件数"""
+
+    def __init__(self):
+        self.reset()
+        atexit.register(self.flush)  # 进程退出前发送剩余的事件
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # {group: OrderedDict({merge_key: event})}
+        self.pending_count = 0
+        self.resumable = set()  # 事件可补发（分配序号）的组
+        self.metrics = Counter()  # published/merged/dropped/sent/batches/errors
+        self.batch_sizes = Counter()  # {每次group_send包含的事件数: 次数}
+        self.thread = None
+        self.wakeup = threading.Event()  # 有待发送的事件时置位，后台线程据此醒来
+        self.window_dropped = 0  # 当前窗口期内丢弃的事件数，只在窗口期内第一次丢弃时写警告日志
+        self.stats_logged_at = time.monotonic()
+
+    def publish(self, group, event, merge_key=None, resumable=False):
+        """
+        发送事件到组
+        :param group:       频道层的组名
+        :param event:       dict 发给前端的数据，需包含key（即协议中的事件类型）
+        :param merge_key:   窗口期内merge_key相同的事件合并为一条，None表示不合并
+        :param resumable:   是否可补发，发给单个用户的组（如通知）才需要
+        """
+        self.publish_many([group], event, merge_key, resumable)
+
+    def publish_many(self, groups, event, merge_key=None, resumable=False):
+        """同一个事件发送到多个组（如多个接收者），只加一次锁"""
+        if self.pid != os.getpid():
+            # fork出的子进程（如gunicorn、celery的worker）不继承父进程的后台线程
+            self.reset()
+        if settings.NOTIFICATIONS_BROADCAST_WINDOW <= 0:
+            with self.lock:
+                self.metrics['published'] += len(groups)
+            for group in groups:
+                self.send(group, [event], resumable)
+            return
+        with self.lock:
+            for group in groups:
+                self.add(group, event, merge_key)
+            if resumable:
+                self.resumable.update(groups)
+            if self.thread is None and self.pending_count:
+                self.thread = threading.Thread(target=self.run, name='notifications-broadcaster', daemon=True)
+                self.thread.start()
+
+    def add(self, group, event, merge_key):
+        """缓存一个事件，调用时需持有self.lock"""
+        self.metrics['published'] += 1
+        events = self.pending.setdefault(group, OrderedDict())
+        if merge_key is not None and merge_key in events:
+            events[merge_key] = merge_events(events[merge_key], event)
+            self.metrics['merged'] += 1
+            return
+        if self.pending_count >= settings.NOTIFICATIONS_BROADCAST_MAX_PENDING:
+            self.metrics['dropped'] += 1
+            if not self.window_dropped:
+                logger.warning('待发送的WebSocket事件已达上限%d条，丢弃新事件: %s',
+                               settings.NOTIFICATIONS_BROADCAST_MAX_PENDING, group)
+            self.window_dropped += 1
+            return
+        events[object() if merge_key is None else merge_key] = event
+        self.pending_count += 1
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()  # 没有事件时阻塞，不占用CPU
+            time.sleep(settings.NOTIFICATIONS_BROADCAST_WINDOW)  # 收集一个窗口期内的事件
+            self.flush()
+            if time.monotonic() - self.stats_logged_at >= STATS_LOG_INTERVAL:
+                self.log_stats()
+
+    def flush(self):
+        """发送窗口期内缓存的事件，每个组一条消息"""
+        with self.lock:
+            pending, self.pending, self.pending_count = self.pending, OrderedDict(), 0
+            resumable, self.resumable = self.resumable, set()
+            dropped, self.window_dropped = self.window_dropped, 0
+            self.wakeup.clear()
+        if dropped:
+            logger.warning('本窗口期共丢弃%d条WebSocket事件', dropped)
+        for group, events in pending.items():
+            if events:
+                self.send(group, list(events.values()), group in resumable)
+
+    def send(self, group, events, resumable=False):
+        """多个事件作为一条消息发到组，由consumer合并为一帧"""
+        try:
+            publish(group, [make_event(group, event['key'], {field: value for field, value in event.items()
+                                                             if field != 'key'}, resumable) for event in events])
+        except Exception:
+            logger.exception('WebSocket事件发送失败: %s', group)
+            with self.lock:
+                self.metrics['errors'] += 1
+            return
+        with self.lock:
+            self.metrics['batches'] += 1
+            self.metrics['sent'] += len(events)
+            self.batch_sizes[len(events)] += 1
+        logger.debug('WebSocket事件已发送: %s, %d条', group, len(events))
+
+    def stats(self):
+        """当前进程的广播统计"""
+        with self.lock:
+            return dict(self.metrics, pending=self.pending_count, batch_sizes=dict(self.batch_sizes))
+
+    def log_stats(self):
+        """把当前进程的广播统计写入日志"""
+        self.stats_logged_at = time.monotonic()
+        logger.info('WebSocket广播统计(pid=%d): %s', self.pid, self.stats())
+
+
+broadcaster = Broadcaster()
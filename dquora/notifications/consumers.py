@@ -1,10 +1,23 @@
-import json
+import uuid
 
-from channels.generic.websocket import AsyncWebsocketConsumer
+from dquora.websocket import ProtocolConsumer
 
+FEED_GROUP = 'notifications.feed'  # 首页动态页面的客户端，接收“有新动态”提示
+MAX_SUBSCRIPTIONS = 500  # 每个连接最多订阅的动态数
 
-class NotificationsConsumer(AsyncWebsocketConsumer):
-    """处理通知应用中的WebSocket请求"""
+
+def user_group(user_id):
+    """某个用户的所有连接，只接收发给该用户的通知"""
+    return f'notifications.user.{user_id}'
+
+
+def news_group(news_id):
+    """正在浏览某条动态的连接，接收该动态点赞数、评论数的变化"""
+    return f'notifications.news.{news_id}'
+
+
+class NotificationsConsumer(ProtocolConsumer):
+    """处理通知应用中的WebSocket请求，帧格式见dquora/websocket.py"""
 
     async def connect(self):
         """建立连接"""
@@ -12,14 +25,42 @@ class NotificationsConsumer(AsyncWebsocketConsumer):
             # 未登录用户，拒绝连接
             await self.close()
         else:
-            # 把该用户加入到'notifications'组内，进行监听。即所有用户都监听了'notifications'组，只要一有消息，其他用户都能收到
-            await self.channel_layer.group_add('notifications', self.channel_name)
+            # 只加入该用户自己的组，通知按接收者定向发送，不再广播给所有在线用户
+            self.stream = user_group(self.scope['user'].pk)
+            self.groups_joined = {self.stream}
+            await self.channel_layer.group_add(self.stream, self.channel_name)
             await self.accept()
+            await self.start_protocol()
 
-    async def receive(self, text_data=None, bytes_data=None):
-        """从views.py中接受到的数据，accept()进行处理后，再返回给前端"""
-        await self.send(text_data=json.dumps(text_data))
+    async def handle_event(self, event_type, data):
+        """
+        客户端订阅/取消订阅页面上显示的动态：
+        {"v": 1, "t": "subscribe", "d": {"feed": true, "news": ["<uuid>", ...]}}
+        {"v": 1, "t": "unsubscribe", "d": {"news": ["<uuid>", ...]}}
+        """
+        try:
+            groups = {news_group(uuid.UUID(str(news_id))) for news_id in data.get('news', [])}
+        except (TypeError, ValueError, AttributeError):
+            return
+        if data.get('feed'):
+            groups.add(FEED_GROUP)
+        if event_type == 'subscribe':
+            groups -= self.groups_joined
+            groups = set(list(groups)[:max(0, MAX_SUBSCRIPTIONS - len(self.groups_joined))])
+            for group in groups:
+                await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined |= groups
+        elif event_type == 'unsubscribe':
+            groups &= self.groups_joined
+            groups.discard(self.stream)
+            for group in groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+            self.groups_joined -= groups
 
     async def disconnect(self, code):
         """断开连接"""
-        await self.channel_layer.group_discard('notifications', self.channel_name)
+        try:
+            await super(NotificationsConsumer, self).disconnect(code)
+        finally:
+            for group in getattr(self, 'groups_joined', ()):
+                await self.channel_layer.group_discard(group, self.channel_name)
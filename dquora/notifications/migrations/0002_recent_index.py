@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'unread', 'created_at'], name='notification_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0002_recent_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('L', '赞了'), ('C', '评论了'), ('F', '收藏了'), ('A', '回答了'), ('W', '接受了回答'), ('R', '回复了'), ('I', '登录'), ('O', '退出')], max_length=1, verbose_name='通知类别')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='数量')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_rollups', to=settings.AUTH_USER_MODEL, verbose_name='接收者')),
+            ],
+            options={
+                'verbose_name': '通知归档统计',
+                'verbose_name_plural': '通知归档统计',
+                'unique_together': {('recipient', 'verb')},
+            },
+        ),
+    ]
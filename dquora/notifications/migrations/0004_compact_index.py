@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_notification_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['unread', 'created_at'], name='notification_compact_idx'),
+        ),
+    ]
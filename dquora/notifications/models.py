@@ -1,14 +1,28 @@
+import json
 import uuid
+from collections import Counter, defaultdict
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.cache import cache
+from django.db.models.signals import post_delete
 # third-packages
 from slugify import slugify
 
 
+BULK_CREATE_BATCH_SIZE = 500  # 批量创建通知时每条INSERT插入的行数
+RECENT_LIMIT = 5  # 铃铛弹出框中显示的最近未读通知数
+CACHE_TIMEOUT = 60 * 60  # 未读数和最近未读通知的缓存时间，增量更新出现偏差时最多持续这么久
+# 未命中时按查询结果缓存的未读数只保留这么久（秒），查询期间新建的通知最多这么久后计入
+UNREAD_COUNT_MISS_TIMEOUT = 60
+COMPACT_BATCH_SIZE = 1000  # 清理已读通知时每个事务删除的行数
+
+
 class NotificationQuerySet(models.query.QuerySet):
     def unread(self):
         return self.filter(unread=True)
@@ -16,31 +30,115 @@ class NotificationQuerySet(models.query.QuerySet):
     def read(self):
         return self.filter(unread=False)
 
+    def set_action_objects(self, notifications):
+        """
+        显示通知列表时使用：动作对象按content_type分组，每种模型一次批量查询后放入GenericForeignKey的缓存，
+        渲染N条通知的查询数不再随N增长（触发者请在查询时select_related('actor')）
+        Django 2.2的prefetch_related('action_object')无法匹配UUID主键的模型（如News），所以不用它
+        :param notifications: Notification的列表
+        """
+        object_ids = defaultdict(set)
+        for notification in notifications:
+            if notification.content_type_id is not None:
+                object_ids[notification.content_type_id].add(notification.object_id)
+        action_objects = {}
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            for obj in model._default_manager.filter(pk__in=ids):
+                action_objects[(content_type_id, str(obj.pk))] = obj
+        for notification in notifications:
+            action_object = action_objects.get((notification.content_type_id, notification.object_id))
+            if action_object is not None:
+                Notification.action_object.set_cached_value(notification, action_object)
+        return notifications
+
     def mark_all_as_read(self, recipient=None):
         """标记已读， 可以传入接收者参数"""
         qs = self.unread()
         if recipient:
             qs = qs.filter(recipient=recipient)
-        return qs.update(unread=False)
+        return qs.update_unread(False)
 
     def mark_all_as_unread(self, recipient=None):
         """标为未读， 可以传入接收者参数"""
         qs = self.read()
         if recipient:
             qs = qs.filter(recipient=recipient)
-        return qs.update(unread=True)
+        return qs.update_unread(True)
+
+    def update_unread(self, unread):
+        """批量修改已读状态，并清除受影响接收者的未读缓存"""
+        recipient_ids = list(self.order_by().values_list('recipient_id', flat=True).distinct())
+        count = self.update(unread=unread)
+        invalidate_unread_cache(recipient_ids)
+        return count
+
+    def create_bulk(self, notifications, batch_size=BULK_CREATE_BATCH_SIZE):
+        """
+        批量创建通知，bulk_create不会调用save()，这里在内存中生成slug，分批插入
+        :param notifications:   list of dict，每个dict是一个动作，包含actor_id、recipient_ids、verb、
+                                content_type_id、object_id，为recipient_ids中的每个接收者各创建一条通知
+        :param batch_size:      每条INSERT语句插入的行数
+        """
+        recipient_ids = {pk for item in notifications for pk in item['recipient_ids']}
+        usernames = dict(get_user_model().objects.filter(pk__in=recipient_ids).values_list('pk', 'username'))
+        objs = []
+        for item in notifications:
+            for recipient_id in item['recipient_ids']:
+                obj = Notification(actor_id=item['actor_id'], recipient_id=recipient_id, verb=item['verb'],
+                                   content_type_id=item['content_type_id'], object_id=item['object_id'])
+                obj.slug = slugify(f'{usernames.get(recipient_id)} {obj.uuid_id} {obj.verb}')
+                objs.append(obj)
+        objs = self.bulk_create(objs, batch_size=batch_size)
+        notifications_created([obj.recipient_id for obj in objs])
+        return objs
+
+    def compact(self, before, batch_size=COMPACT_BATCH_SIZE, max_batches=None):
+        """
+        分批删除before之前的已读通知，删除前按接收者、通知类别把数量累加到NotificationRollup
+        每批一个事务，避免长时间锁表
+        :param before:      datetime 只删除此时间之前创建的通知
+        :param batch_size:  每批删除的行数
+        :param max_batches: 最多删除的批数，None表示删完为止
+        :return:            int 删除的通知数
+        """
+        deleted = batches = 0
+        while max_batches is None or batches < max_batches:
+            with transaction.atomic():
+                pks = list(self.read().filter(created_at__lt=before).order_by('created_at')
+                           .select_for_update().values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                batch = Notification.objects.filter(pk__in=pks, unread=False)
+                NotificationRollup.objects.add_counts(
+                    batch.exclude(recipient=None).order_by().values_list('recipient_id', 'verb').annotate(Count('pk')))
+                deleted += batch.delete()[1].get(Notification._meta.label, 0)
+            batches += 1
+        return deleted
 
     def get_most_recent(self, recipient=None):
-        """获取最近5条未读通知"""
-        qs = self.unread()[:5]
+        """获取最近RECENT_LIMIT条未读通知，先按接收者过滤再排序、切片，使用notification_recent_idx索引"""
+        qs = self.unread()
         if recipient:
-            qs = qs.filter(recipient=recipient)[:5]
-        return qs
+            qs = qs.filter(recipient=recipient)
+        return qs.order_by('-created_at')[:RECENT_LIMIT]
 
     def serialize_latest_notifications(self, recipient=None):
-        """序列化最近5条未读通知，可以传入接收者参数"""
-        qs = self.get_most_recent(recipient)
-        notification_dic = serializers.serialize('json', qs)
+        """序列化最近5条未读通知，可以传入接收者参数；只查询需要的字段，不实例化模型"""
+        qs = self.get_most_recent(recipient).values(
+            'uuid_id', 'slug', 'verb', 'unread', 'created_at', 'content_type_id', 'object_id', 'actor__username')
+        notification_dic = json.dumps([{
+            'pk': notification['uuid_id'],
+            'slug': notification['slug'],
+            'actor': notification['actor__username'],
+            'verb': notification['verb'],
+            'unread': notification['unread'],
+            'created_at': notification['created_at'],
+            'content_type': notification['content_type_id'],
+            'object_id': notification['object_id'],
+        } for notification in qs], cls=DjangoJSONEncoder)
         return notification_dic
 
 
@@ -77,6 +175,12 @@ class Notification(models.Model):
         verbose_name = '通知'
         verbose_name_plural = verbose_name
         ordering = ('-created_at',)
+        indexes = [
+            # 铃铛、未读数：按接收者和已读状态过滤后按时间倒序取最近几条
+            models.Index(fields=['recipient', 'unread', 'created_at'], name='notification_recent_idx'),
+            # 定期清理：按时间顺序取超过保留期的已读通知
+            models.Index(fields=['unread', 'created_at'], name='notification_compact_idx'),
+        ]
 
     def __str__(self):
         if self.action_object:
@@ -87,7 +191,12 @@ class Notification(models.Model):
              update_fields=None):
         if not self.slug:
             self.slug = slugify(f'{self.recipient} {self.uuid_id} {self.verb}')
+        adding = self._state.adding
         super(Notification, self).save()
+        if adding and self.unread:
+            notifications_created([self.recipient_id])
+        else:
+            invalidate_unread_cache([self.recipient_id])
 
     def mark_as_read(self):
         if self.unread:
@@ -98,3 +207,112 @@ class Notification(models.Model):
         if not self.unread:
             self.unread = True
             self.save()
+
+
+def unread_count_key(recipient_id):
+    return f'notifications:unread_count:{recipient_id}'
+
+
+def recent_unread_key(recipient_id):
+    return f'notifications:recent_unread:{recipient_id}'
+
+
+def get_unread_count(recipient_id):
+    """用户的未读通知数，缓存未命中时查询数据库"""
+    count = cache.get(unread_count_key(recipient_id))
+    if count is None:
+        count = Notification.objects.filter(recipient_id=recipient_id, unread=True).count()
+        # COUNT和写缓存之间新建的通知，其incr会落空而不计入这里的count，所以只短暂缓存
+        cache.add(unread_count_key(recipient_id), count, UNREAD_COUNT_MISS_TIMEOUT)
+    return count
+
+
+def get_recent_unread(recipient_id):
+    """
+    用户最近的RECENT_LIMIT条未读通知，缓存为dict的列表，命中时不再查询通知及其动作对象
+    :return: list of dict，包含slug、verb、text、created_at
+    """
+    notifications = cache.get(recent_unread_key(recipient_id))
+    if notifications is None:
+        qs = Notification.objects.select_related('actor').get_most_recent(recipient_id)
+        Notification.objects.set_action_objects(qs)
+        notifications = [{
+            'slug': notification.slug,
+            'verb': notification.verb,
+            'text': str(notification),
+            'created_at': notification.created_at
+        } for notification in qs]
+        cache.add(recent_unread_key(recipient_id), notifications, CACHE_TIMEOUT)
+    return notifications
+
+
+def notifications_created(recipient_ids):
+    """新建了未读通知：已缓存的未读数直接加上新增的数量，最近未读通知列表重新生成"""
+    keys = [recent_unread_key(recipient_id) for recipient_id in set(recipient_ids)]
+    for recipient_id, count in Counter(recipient_ids).items():
+        try:
+            cache.incr(unread_count_key(recipient_id), count)
+        except ValueError:
+            # 未缓存。可能有请求正在查询数据库，其结果不含这次新建的通知，删除它刚写入的未读数
+            keys.append(unread_count_key(recipient_id))
+    cache.delete_many(keys)
+
+
+def invalidate_unread_cache(recipient_ids):
+    """已读状态变化或通知被删除后，清除这些接收者的未读缓存"""
+    keys = []
+    for recipient_id in set(recipient_ids):
+        keys += [unread_count_key(recipient_id), recent_unread_key(recipient_id)]
+    if keys:
+        cache.delete_many(keys)
+
+
+class NotificationRollupQuerySet(models.query.QuerySet):
+    def add_counts(self, counts):
+        """
+        累加已归档通知的数量，汇总行不存在时创建
+        :param counts: (recipient_id, verb, count)的可迭代对象
+        """
+        for recipient_id, verb, count in counts:
+            if self.filter(recipient_id=recipient_id, verb=verb).update(count=F('count') + count):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(recipient_id=recipient_id, verb=verb, count=count)
+            except IntegrityError:
+                # 另一个worker同时创建了该行（unique_together），此时更新一定能命中
+                self.filter(recipient_id=recipient_id, verb=verb).update(count=F('count') + count)
+
+    def totals(self, recipient):
+        """接收者各类别通知的累计数量：已归档的加上仍在通知表中的，{verb: count}"""
+        totals = Counter(dict(self.filter(recipient=recipient).values_list('verb', 'count')))
+        totals.update(dict(Notification.objects.filter(recipient=recipient).order_by()
+                           .values_list('verb').annotate(Count('pk'))))
+        return dict(totals)
+
+
+class NotificationRollup(models.Model):
+    """已归档（从通知表中删除）的已读通知，按接收者和通知类别汇总的数量"""
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='notification_rollups',
+                                  on_delete=models.CASCADE, verbose_name='接收者')
+    verb = models.CharField(max_length=1, choices=Notification.NOTIFICATION_TYPE, verbose_name='通知类别')
+    count = models.PositiveIntegerField(default=0, verbose_name='数量')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    objects = NotificationRollupQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '通知归档统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('recipient', 'verb')
+
+    def __str__(self):
+        return f'{self.recipient} {self.get_verb_display()} {self.count}'
+
+
+def notification_deleted(sender, instance, **kwargs):
+    if instance.unread:
+        # 已读通知不在未读缓存中，清理已读通知时无需处理
+        invalidate_unread_cache([instance.recipient_id])
+
+
+post_delete.connect(receiver=notification_deleted, sender=Notification)
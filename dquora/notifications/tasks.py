@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from dquora.taskapp.celery import app
+from dquora.notifications.models import Notification
+from dquora.notifications.consumers import user_group
+from dquora.notifications.broadcast import broadcaster
+
+
+@app.task(ignore_result=True)
+def deliver_notifications(notifications):
+    """
+    批量创建通知并推送给各接收者
+    :param notifications: list of dict，由notification_handler生成
+    """
+    Notification.objects.create_bulk(notifications)
+    for item in notifications:
+        # WS: 只发给各接收者所在的组，窗口期内发给同一接收者的通知合并为一条
+        payload = {
+            'key': item['key'],  # 前端收到该参数后把铃铛变为红色
+            'actor_names': [item['actor_name']]
+        }
+        broadcaster.publish_many([user_group(pk) for pk in item['recipient_ids']], payload,
+                                 merge_key=item['key'], resumable=True)
+
+
+@app.task()
+def compact_notifications():
+    """定期删除超过保留期的已读通知，删除前按接收者、类别汇总到NotificationRollup"""
+    before = timezone.now() - timedelta(days=settings.NOTIFICATIONS_RETENTION_DAYS)
+    return Notification.objects.compact(before, max_batches=settings.NOTIFICATIONS_COMPACT_MAX_BATCHES)
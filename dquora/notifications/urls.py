@@ -8,5 +8,6 @@ urlpatterns = [
     path('mark-as-read/<str:slug>/', views.mark_as_read, name='mark_as_read'),
     path('mark-all-as-read/', views.mark_all_as_read, name='mark_all_read'),
     path('latest-notifications/', views.get_latest_notifications, name='latest_notifications'),
+    path('unread-count/', views.unread_count, name='unread_count'),
 
 ]
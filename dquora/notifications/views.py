@@ -1,13 +1,20 @@
+import logging
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.views.generic import ListView
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from asgiref.sync import async_to_sync
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
 
-from channels.layers import get_channel_layer
+from dquora.notifications.models import Notification, get_recent_unread, get_unread_count
+from dquora.notifications.tasks import deliver_notifications
 
-from dquora.notifications.models import Notification
+logger = logging.getLogger(__name__)
 
 
 # Create your views here.
@@ -19,16 +26,24 @@ class NotificationUnreadListView(LoginRequiredMixin, ListView):
     template_name = 'notifications/notification_list.html'
 
     def get_queryset(self):
-        return self.request.user.notifications.unread()
+        notifications = self.request.user.notifications.unread().select_related('actor')
+        return Notification.objects.set_action_objects(notifications)
 
 
 @login_required
 def get_latest_notifications(request):
     """最近的未读通知"""
-    notifications = request.user.notifications.get_most_recent()
+    notifications = get_recent_unread(request.user.pk)
     return render(request, 'notifications/most_recent.html', {'notifications': notifications})
 
 
+@login_required
+@require_http_methods(['GET'])
+def unread_count(request):
+    """未读通知数，前端据此决定铃铛是否变为红色"""
+    return JsonResponse({'count': get_unread_count(request.user.pk)})
+
+
 @login_required
 def mark_all_as_read(request):
     """将所有通知标为已读"""
@@ -66,26 +81,67 @@ def notification_handler(actor, recipient, verb, action_object, **kwargs):
     :param recipient:       User instance接收者
     :param verb:            str 通知类型
     :param action_object:   Instance动作对象
-    :param kwargs:          key，id_value等
+    :param kwargs:          key等
     :return:                None
     """
     if actor.username == action_object.user.username and actor.username != recipient.username:
         # 只通知接收者，即recipient == 动作对象的作者
         key = kwargs.get('key', 'notification')
-        id_value = kwargs.get('id_value', None)
-        Notification.objects.create(
-            actor=actor,
-            recipient=recipient,
-            verb=verb,
-            action_object=action_object
-        )
-        # WS: 传递给consumer的receive()方法
-        channel_layer = get_channel_layer()
-        payload = {
-            'type': 'receive',
-            # 传给receive()的数据
-            'key': key,  # 前端收到该参数后的再次触发AJAX请求
-            'id_value': id_value,
-            'actor_name': actor.username
-        }
-        async_to_sync(channel_layer.group_send)('notifications', payload)
+        send_notifications([build_notification(actor, [recipient.pk], verb, action_object, key)])
+
+
+def notify_many(actor, recipients, verb, action_object, key='notification'):
+    """
+    同一个动作通知多个接收者，如动态的所有参与者、问题的所有回答者，触发者自己不会收到通知
+    :param actor:           request.user对象
+    :param recipients:      User instance或主键的可迭代对象
+    :param verb:            str 通知类型
+    :param action_object:   Instance动作对象
+    :param key:             前端用于区分通知类型
+    :return:                int 接收者人数
+    """
+    recipient_ids = []
+    seen = {actor.pk}
+    for recipient in recipients:
+        pk = getattr(recipient, 'pk', recipient)
+        if pk is not None and pk not in seen:  # 跳过已删除的用户（外键为NULL）
+            seen.add(pk)
+            recipient_ids.append(pk)
+    if recipient_ids:
+        send_notifications([build_notification(actor, recipient_ids, verb, action_object, key)])
+    return len(recipient_ids)
+
+
+def build_notification(actor, recipient_ids, verb, action_object, key):
+    """生成传给Celery任务的通知数据，只包含可序列化的字段"""
+    return {
+        'actor_id': actor.pk,
+        'actor_name': actor.username,
+        'recipient_ids': recipient_ids,
+        'verb': verb,
+        'content_type_id': ContentType.objects.get_for_model(action_object).pk,
+        'object_id': str(action_object.pk),
+        'key': key
+    }
+
+
+def send_notifications(notifications):
+    """
+    事务提交后由Celery异步批量创建通知并推送，不在请求中等待数据库写入和Redis往返
+    settings.NOTIFICATIONS_ASYNC为False（测试环境）时同步处理
+    :param notifications:   list of dict，见notification_handler
+    :return:                None
+    """
+    if not settings.NOTIFICATIONS_ASYNC:
+        deliver_notifications(notifications)
+        return
+
+    def enqueue():
+        try:
+            deliver_notifications.delay(notifications)
+        except Exception:
+            # 消息中间人不可用时退回同步处理，不丢失通知
+            logger.exception('通知任务入队失败，改为同步处理')
+            deliver_notifications(notifications)
+
+    transaction.on_commit(enqueue)
@@ -0,0 +1,35 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from dquora.qa.models import Question, Answer, Vote
+
+
+class Command(BaseCommand):
+    """根据Vote表重建问题和回答上的票数计数，用于修复计数偏差"""
+    help = '根据Vote表重建问题和回答的赞同票数、反对票数和得票数'
+
+    def handle(self, *args, **options):
+        for model in (Question, Answer):
+            updated = self.rebuild(model)
+            self.stdout.write(self.style.SUCCESS(f'{model._meta.verbose_name}：已重建{updated}条记录的票数'))
+
+    @staticmethod
+    def rebuild(model):
+        """先清零再按(object_id, value)分组统计写回，返回有投票的记录数"""
+        content_type = ContentType.objects.get_for_model(model)
+        counts = Vote.objects.filter(content_type=content_type).values('object_id').annotate(
+            up=Count('pk', filter=Q(value=True)),
+            down=Count('pk', filter=Q(value=False)),
+        ).order_by()
+        updated = 0
+        with transaction.atomic():
+            model.objects.update(up_votes=0, down_votes=0, vote_score=0)
+            for row in counts.iterator():
+                updated += model.objects.filter(pk=row['object_id']).update(
+                    up_votes=row['up'],
+                    down_votes=row['down'],
+                    vote_score=row['up'] - row['down'],
+                )
+        return updated
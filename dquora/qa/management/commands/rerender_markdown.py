@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dquora.articles.models import Article
+from dquora.helpers import render_markdown, markdown_hash
+from dquora.qa.models import Question, Answer
+
+MARKDOWN_FIELDS = ['content_html', 'excerpt', 'content_hash']
+
+
+def init_worker():
+    """子进程初始化：spawn方式启动时需要重新加载Django"""
+    django.setup()
+
+
+def render_row(row):
+    """
+    在子进程中渲染一条记录
+    :param row:  (主键, Markdown内容, 已缓存的内容摘要, 是否强制渲染)
+    :return:     (主键, HTML, 摘要, 内容摘要)，缓存未过期时返回None
+    """
+    pk, content, content_hash, force = row
+    if not force and content_hash == markdown_hash(content):
+        return None
+    return (pk,) + render_markdown(content)
+
+
+class Command(BaseCommand):
+    """
+    修改markdownx扩展或过滤规则后（记得把helpers.MARKDOWN_RENDER_VERSION加一），
+    按主键分批读取问题、回答和文章，用进程池并行渲染Markdown，再bulk_update写回。
+    指定--checkpoint时每批写回后记录进度，中断后再次执行会从断点继续
+    """
+    help = '使用进程池批量重新渲染问题、回答和文章的Markdown'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='渲染进程数，默认为CPU核数')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批读取和写回的记录数')
+        parser.add_argument('--checkpoint', help='进度文件路径，存在时从中记录的位置继续')
+        parser.add_argument('--force', action='store_true', help='忽略内容摘要，全部重新渲染')
+
+    def handle(self, *args, **options):
+        self.workers = options['workers']
+        self.chunk_size = options['chunk_size']
+        self.force = options['force']
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = self.load_checkpoint()
+        # 子进程会继承父进程的数据库连接，fork前先关闭
+        connections.close_all()
+        with Pool(self.workers, initializer=init_worker) as pool:
+            for model in (Question, Answer, Article):
+                self.rerender(pool, model)
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)  # 全部完成，删除进度文件
+
+    def load_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self.stdout.write(f'从断点继续：{checkpoint}')
+            return checkpoint
+        return {}
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)  # 原子替换，避免中断时写出半个文件
+
+    def rerender(self, pool, model):
+        label = model._meta.label_lower
+        state = self.checkpoint.setdefault(label, {'last_pk': None, 'done': False})
+        if state['done']:
+            self.stdout.write(f'{label}：已完成，跳过')
+            return
+        queryset = model.objects.order_by('pk').values_list('pk', 'content', 'content_hash')
+        scanned = updated = 0
+        started = time.monotonic()
+        while True:
+            # 按主键分批（keyset），不使用OFFSET，越往后也不会变慢
+            chunk = queryset
+            if state['last_pk'] is not None:
+                chunk = chunk.filter(pk__gt=state['last_pk'])
+            rows = list(chunk[:self.chunk_size])
+            if not rows:
+                break
+            results = pool.map(render_row, [row + (self.force,) for row in rows],
+                               chunksize=max(1, len(rows) // (self.workers * 4)))
+            objs = [model(pk=pk, content_html=html, excerpt=excerpt, content_hash=content_hash)
+                    for pk, html, excerpt, content_hash in filter(None, results)]
+            model.objects.bulk_update(objs, MARKDOWN_FIELDS)
+            scanned += len(rows)
+            updated += len(objs)
+            state['last_pk'] = str(rows[-1][0])
+            self.save_checkpoint()
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{label}：已扫描{scanned}条，渲染{updated}条，{scanned / elapsed:.1f}条/秒')
+        state['done'] = True
+        self.save_checkpoint()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}：完成，共扫描{scanned}条，渲染{updated}条，用时{elapsed:.1f}秒'))
@@ -0,0 +1,67 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:30
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_vote_counts(apps, schema_editor):
+    """根据已有的Vote记录初始化票数计数"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Vote = apps.get_model('qa', 'Vote')
+    for model_name in ('question', 'answer'):
+        model = apps.get_model('qa', model_name)
+        content_type = ContentType.objects.filter(app_label='qa', model=model_name).first()
+        if content_type is None:
+            continue
+        counts = Vote.objects.filter(content_type=content_type).values('object_id').annotate(
+            up=Count('pk', filter=Q(value=True)),
+            down=Count('pk', filter=Q(value=False)),
+        ).order_by()
+        for row in counts.iterator():
+            model.objects.filter(pk=row['object_id']).update(
+                up_votes=row['up'],
+                down_votes=row['down'],
+                vote_score=row['up'] - row['down'],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('qa', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='down_votes',
+            field=models.IntegerField(default=0, verbose_name='反对票数'),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='up_votes',
+            field=models.IntegerField(default=0, verbose_name='赞同票数'),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='vote_score',
+            field=models.IntegerField(default=0, verbose_name='得票数'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='down_votes',
+            field=models.IntegerField(default=0, verbose_name='反对票数'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='up_votes',
+            field=models.IntegerField(default=0, verbose_name='赞同票数'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='vote_score',
+            field=models.IntegerField(default=0, verbose_name='得票数'),
+        ),
+        migrations.RunPython(backfill_vote_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0002_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, verbose_name='内容摘要'),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='内容HTML'),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='摘要'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, verbose_name='内容摘要'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='内容HTML'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='摘要'),
+        ),
+    ]
@@ -1,7 +1,8 @@
 import uuid
-from collections import Counter
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
@@ -10,7 +11,71 @@ from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelatio
 from slugify import slugify
 from taggit.managers import TaggableManager
 from markdownx.models import MarkdownxField
-from markdownx.utils import markdownify
+
+from dquora.helpers import MarkdownContentModel
+from dquora.tags.models import TagCount, register_tag_counts
+
+
+class VoteQuerySet(models.query.QuerySet):
+    """自定义Vote的QuerySet API"""
+
+    def switch_vote(self, user, obj, value):
+        """
+        赞同/反对或取消，一次事务内完成并返回最新得票数
+        :param user: 投票用户
+        :param obj: 被投票的问题或回答
+        :param value: True赞同，False反对
+        :return: int 最新得票数
+        """
+        content_type = ContentType.objects.get_for_model(obj)  # ContentType有进程内缓存，不查库
+        lookup = {'user': user, 'content_type': content_type, 'object_id': str(obj.pk)}
+        with transaction.atomic():
+            for _ in range(2):
+                # 先插入：首次投票直接成功。不先用select_for_update查询，
+                # 因为在MySQL(InnoDB)的REPEATABLE READ下锁定不存在的行会加间隙锁，不同用户同时首次投票会死锁
+                try:
+                    with transaction.atomic():
+                        self.model(value=value, **lookup).save(force_insert=True)
+                    break
+                except IntegrityError:
+                    pass
+                # 已经投过票：联合唯一键(user, content_type, object_id)命中已有的行，锁定后改票或取消
+                vote = self.select_for_update().filter(**lookup).first()
+                if vote is None:
+                    continue  # 该投票刚被同一用户的并发请求取消，重新插入一次
+                if vote.value == value:
+                    # 重复点击同一按钮，取消投票
+                    vote.delete()
+                else:
+                    # 赞改踩或踩改赞
+                    vote.value = value
+                    vote.save(update_fields=['value', 'updated_at'])
+                break
+        # 计数已随投票在数据库中更新，按主键读取，无需统计Vote表
+        return type(obj).objects.filter(pk=obj.pk).values_list('vote_score', flat=True).get()
+
+    def set_user_votes(self, user, objs):
+        """
+        一次查询取出用户对一组问题/回答的投票，写到每个对象的user_vote属性上
+        :param user: 当前登录用户
+        :param objs: 问题和回答实例的列表
+        :return: None，user_vote为True赞同、False反对、None未投票
+        """
+        for obj in objs:
+            obj.user_vote = None
+        if not objs or not user.is_authenticated:
+            return
+        content_types = ContentType.objects.get_for_models(*{type(obj) for obj in objs})  # 有进程内缓存
+        votes = {
+            (content_type_id, object_id): value
+            for content_type_id, object_id, value in self.filter(
+                user=user,
+                content_type__in=set(content_types.values()),
+                object_id__in={str(obj.pk) for obj in objs},
+            ).values_list('content_type_id', 'object_id', 'value')
+        }
+        for obj in objs:
+            obj.user_vote = votes.get((content_types[type(obj)].pk, str(obj.pk)))
 
 
 class Vote(models.Model):
@@ -25,6 +90,7 @@ class Vote(models.Model):
     vote = GenericForeignKey('content_type', 'object_id')  # 等同于GenericForeignKey
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    objects = VoteQuerySet.as_manager()
 
     class Meta:
         verbose_name = '投票'
@@ -32,6 +98,48 @@ class Vote(models.Model):
         unique_together = ('user', 'content_type', 'object_id')  # 联合唯一键：每个用户只能对一条记录投票一次（赞同或反对）
         index_together = ('content_type', 'object_id')  # 联合唯一索引：SQL优化，conttenttype_id、object_id确定一条记录。
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """记录从数据库读出时的投票值，保存时用来判断是否改票"""
+        instance = super(Vote, cls).from_db(db, field_names, values)
+        instance._loaded_value = instance.__dict__.get('value')
+        return instance
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        # 新增或改票时，在同一事务里同步更新被投票对象上的票数计数
+        old_value = None if self._state.adding else getattr(self, '_loaded_value', None)
+        with transaction.atomic(using=using):
+            super(Vote, self).save(force_insert, force_update, using, update_fields)
+            self.apply_vote_delta(old_value, self.value)
+        self._loaded_value = self.value
+
+    def apply_vote_delta(self, old_value, new_value):
+        """
+        把一次投票变化累加到问题或回答的票数计数上
+        :param old_value: 变化前的投票值，None表示之前没有投票
+        :param new_value: 变化后的投票值，None表示投票被删除
+        """
+        up = (new_value is True) - (old_value is True)
+        down = (new_value is False) - (old_value is False)
+        if not up and not down:
+            return
+        model = ContentType.objects.get_for_id(self.content_type_id).model_class()
+        # 使用F()表达式在数据库里原子地加减，避免并发投票时互相覆盖
+        model.objects.filter(pk=self.object_id).update(
+            up_votes=F('up_votes') + up,
+            down_votes=F('down_votes') + down,
+            vote_score=F('vote_score') + up - down,
+        )
+
+
+def vote_deleted(sender, instance, **kwargs):
+    """投票被删除（包括级联删除）时扣减票数计数"""
+    instance.apply_vote_delta(instance.value, None)
+
+
+post_delete.connect(receiver=vote_deleted, sender=Vote)
+
 
 class QuestionQuerySet(models.query.QuerySet):
     """自定义QuerySet， 提高模型类的可用性"""
@@ -44,22 +152,20 @@ class QuestionQuerySet(models.query.QuerySet):
         """未有回答的问题"""
         return self.filter(has_answer=False)
 
-    def get_counted_tags(self):
+    def for_list(self):
+        """
+        问题列表页使用：一次查询带出回答数和提问者，标签一次预取，
+        得票数是Question上的计数字段，避免每个问题卡片单独查询
+        """
+        return self.select_related('user').prefetch_related('tags').annotate(answer_count=models.Count('answer'))
+
+    def get_counted_tags(self, limit=None, min_count=1):
         """统计所有问题， 每一个标签的数量（大于0的）"""
-        tag_dict = {}
-        # filter()里的tags应该用tagged别名把，这个地方写的有问题？？？
-        query = self.all().annotate(tagged=models.Count('tags')).filter(tags__gt=0)
-        for obj in query:
-            for tag in obj.tags.names():
-                if tag not in tag_dict:
-                    tag_dict[tag] = 1
-                else:
-                    tag_dict[tag] += 1
-        return tag_dict.items()
+        return TagCount.objects.popular(self.model, limit=limit, min_count=min_count)
 
 
 # Create your models here.
-class Question(models.Model):
+class Question(MarkdownContentModel):
     STATUS = (('O', 'Open'), ('C', 'Close'), ('D', 'Draft'))
     title = models.CharField(max_length=255, unique=True, verbose_name='标题')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
@@ -71,6 +177,10 @@ class Question(models.Model):
     tags = TaggableManager(help_text='多个标签使用,(英文)逗号隔开', verbose_name='标签')
     has_answer = models.BooleanField(default=False, verbose_name='接受回答')  # 是否有接受的回答
     votes = GenericRelation(Vote, verbose_name='投票情况')  # 通过GenericRelation关联到Vote表，votes它不是一个字段,而是Vote对象
+    # 票数计数，由Vote的保存和删除同步维护，可用rebuild_vote_counts命令重建
+    up_votes = models.IntegerField(default=0, verbose_name='赞同票数')
+    down_votes = models.IntegerField(default=0, verbose_name='反对票数')
+    vote_score = models.IntegerField(default=0, verbose_name='得票数')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     # 添加自定义QuerySet
@@ -89,39 +199,50 @@ class Question(models.Model):
         # 用文章标题生成文章在URL中的别名
         if not self.slug:
             self.slug = slugify(self.title)
-            super(Question, self).save()
-
-    def get_markdown(self):
-        """将Markdown文本转换为html"""
-        return markdownify(self.content)
+        # 传递update_fields，只更新部分字段时不会用内存中的旧值覆盖票数计数
+        super(Question, self).save(force_insert, force_update, using, update_fields)
 
     def total_votes(self):
         """得票数 = 赞同票 - 反对票"""
-        vote_dict = Counter(self.votes.values_list('value', flat=True))
-        return vote_dict[True] - vote_dict[False]
+        return self.vote_score
 
     def get_answers(self):
         """获取所有的回答"""
         return Answer.objects.filter(question=self)
 
+    def get_detail_answers(self, user):
+        """
+        问题详情页使用：回答和回答者一次查询，当前用户对问题及所有回答的投票一次查询，
+        投票情况写在问题和各回答的user_vote属性上
+        """
+        answers = list(self.get_answers().select_related('user'))
+        self.answer_count = len(answers)
+        Vote.objects.set_user_votes(user, [self] + answers)
+        return answers
+
     def count_answers(self):
-        """回答的数量"""
+        """回答的数量，列表页已通过for_list()注解时直接使用"""
+        if hasattr(self, 'answer_count'):
+            return self.answer_count
         return self.get_answers().count()
 
     def get_upvoters(self):
         """赞同的用户"""
-        return [vote.user for vote in self.votes.filter(value=True)]
+        return [vote.user for vote in self.votes.filter(value=True).select_related('user')]
 
     def get_downvoter(self):
         """反对的用户"""
-        return [vote.user for vote in self.votes.filter(value=False)]
+        return [vote.user for vote in self.votes.filter(value=False).select_related('user')]
 
     def get_accepted_answer(self):
         """获取问题被接受的回答"""
         return Answer.objects.get(question=self, is_answer=True)
 
 
-class Answer(models.Model):
+register_tag_counts(Question)
+
+
+class Answer(MarkdownContentModel):
     uuid_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='a_author', on_delete=models.CASCADE,
                              verbose_name='回答者')
@@ -129,6 +250,10 @@ class Answer(models.Model):
     content = MarkdownxField(verbose_name='内容')
     is_answer = models.BooleanField(default=False, verbose_name='回答是否被接受')
     votes = GenericRelation(Vote, verbose_name='投票情况')  # 通过GenericRelation关联到Vote表，votes它不是一个字段
+    # 票数计数，由Vote的保存和删除同步维护，可用rebuild_vote_counts命令重建
+    up_votes = models.IntegerField(default=0, verbose_name='赞同票数')
+    down_votes = models.IntegerField(default=0, verbose_name='反对票数')
+    vote_score = models.IntegerField(default=0, verbose_name='得票数')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
@@ -140,21 +265,17 @@ class Answer(models.Model):
     def __str__(self):
         return self.content
 
-    def get_markdown(self):
-        return markdownify(self.content)
-
     def total_votes(self):
         """得票数"""
-        dic = Counter(self.votes.values_list('value', flat=True))  # Counter赞同票多少，反对票少数
-        return dic[True] - dic[False]
+        return self.vote_score
 
     def get_upvoters(self):
         """赞同的用户"""
-        return [vote.user for vote in self.votes.filter(value=True)]
+        return [vote.user for vote in self.votes.filter(value=True).select_related('user')]
 
     def get_downvoters(self):
         """反对的用户"""
-        return [vote.user for vote in self.votes.filter(value=False)]
+        return [vote.user for vote in self.votes.filter(value=False).select_related('user')]
 
     def accept_answer(self):
         """接受回答"""
@@ -163,7 +284,7 @@ class Answer(models.Model):
         answer_set.update(is_answer=False)  # 一律置为未接受
         # 接受当前回答并保存
         self.is_answer = True
-        self.save()
+        self.save(update_fields=['is_answer', 'updated_at'])  # 只更新接受状态，不覆盖并发投票更新的计数
         # 该问题已有被接受的回答，保存
         self.question.has_answer = True
-        self.question.save()
+        self.question.save(update_fields=['has_answer', 'updated_at'])
@@ -0,0 +1,63 @@
+import pytest
+
+from dquora.qa.models import Question, Answer, Vote
+from dquora.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def vote_counts(obj):
+    obj.refresh_from_db(fields=['up_votes', 'down_votes', 'vote_score'])
+    return obj.up_votes, obj.down_votes, obj.vote_score
+
+
+@pytest.fixture
+def question(user):
+    return Question.objects.create(user=user, title='问题', content='内容')
+
+
+def test_question_vote_counters_on_create_flip_and_delete(question):
+    voter, other = UserFactory(), UserFactory()
+    question.votes.create(user=voter, value=True)
+    question.votes.create(user=other, value=True)
+    assert vote_counts(question) == (2, 0, 2)
+
+    vote = question.votes.get(user=other)
+    vote.value = False
+    vote.save()
+    assert vote_counts(question) == (1, 1, 0)
+
+    question.votes.get(user=voter).delete()
+    assert vote_counts(question) == (0, 1, -1)
+
+
+def test_answer_vote_counters_follow_deleted_voter(question):
+    voter = UserFactory()
+    answer = Answer.objects.create(user=question.user, question=question, content='回答')
+    answer.votes.create(user=voter, value=False)
+    question.votes.create(user=voter, value=True)
+    assert vote_counts(answer) == (0, 1, -1)
+
+    # 删除用户时级联删除其投票，计数同步扣减
+    voter.delete()
+    assert vote_counts(answer) == (0, 0, 0)
+    assert vote_counts(question) == (0, 0, 0)
+
+
+def test_switch_vote_toggles_and_flips(question):
+    voter = UserFactory()
+    assert Vote.objects.switch_vote(voter, question, True) == 1
+    # 赞改踩
+    assert Vote.objects.switch_vote(voter, question, False) == -1
+    assert vote_counts(question) == (0, 1, -1)
+    # 再点一次同一按钮取消投票
+    assert Vote.objects.switch_vote(voter, question, False) == 0
+    assert not Vote.objects.exists()
+    assert vote_counts(question) == (0, 0, 0)
+
+
+def test_switch_vote_on_answer_leaves_question_alone(question):
+    answer = Answer.objects.create(user=question.user, question=question, content='回答')
+    assert Vote.objects.switch_vote(UserFactory(), answer, True) == 1
+    assert vote_counts(answer) == (1, 0, 1)
+    assert vote_counts(question) == (0, 0, 0)
@@ -7,10 +7,11 @@ from django.views.decorators.http import require_http_methods
 from django.http import JsonResponse
 from django.core.exceptions import PermissionDenied
 
-from dquora.qa.models import Question, Answer
+from dquora.qa.models import Question, Answer, Vote
 from dquora.helpers import ajax_required
 from dquora.qa.forms import QuestionForm
-from dquora.notifications.views import notification_handler
+from dquora.tags.models import TagCount
+from dquora.notifications.views import notify_many
 
 
 # Create your views here.
@@ -22,9 +23,12 @@ class QuestionListView(ListView):
     context_object_name = 'questions'
     template_name = 'qa/question_list.html'
 
+    def get_queryset(self):
+        return Question.objects.for_list()
+
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(QuestionListView, self).get_context_data()
-        context['popular_tags'] = Question.objects.get_counted_tags()  # 标签字典
+        context['popular_tags'] = TagCount.objects.popular(Question)  # 热门标签
         context['active'] = 'all'  # 有三个导航栏
         return context
 
@@ -33,7 +37,7 @@ class UnansweredQuestionListView(QuestionListView):
     """未接受回答的问题"""
 
     def get_queryset(self):
-        return Question.objects.get_unanswered()
+        return Question.objects.get_unanswered().for_list()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(UnansweredQuestionListView, self).get_context_data()
@@ -45,7 +49,7 @@ class AnsweredQuestionListView(QuestionListView):
     """已接受回答的问题"""
 
     def get_queryset(self):
-        return Question.objects.get_answered()
+        return Question.objects.get_answered().for_list()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(AnsweredQuestionListView, self).get_context_data()
@@ -72,6 +76,15 @@ class QuestionDetailView(LoginRequiredMixin, DetailView):
     context_object_name = 'question'
     template_name = 'qa/question_detail.html'
 
+    def get_queryset(self):
+        return Question.objects.select_related('user').prefetch_related('tags')
+
+    def get_context_data(self, **kwargs):
+        context = super(QuestionDetailView, self).get_context_data(**kwargs)
+        # 回答、回答者以及当前用户的投票情况一次性取出，模板中不再逐条查询
+        context['answers'] = self.object.get_detail_answers(self.request.user)
+        return context
+
 
 class AnswerCreateView(LoginRequiredMixin, CreateView):
     """回答问题"""
@@ -99,35 +112,10 @@ def question_vote(request):
     """给问题投票，AJAX POST请求"""
     question_id = request.POST["question"]
     value = True if request.POST["value"] == 'U' else False  # 'U'表示赞，'D'表示踩
-    question = Question.objects.get(pk=question_id)
-    users = question.votes.values_list('user', flat=True)  # 当前问题的所有投票用户
-    # 点赞或踩一共五种情况，利用update_or_create（）简化为两种情况。
-    if request.user.pk in users and (question.votes.get(user=request.user).value == value):
-        question.votes.get(user=request.user).delete()
-    else:
-        question.votes.update_or_create(user=request.user, defaults={"value": value})
-
-    """
-    # 1.用户首次操作，点赞/踩
-    if request.user.pk not in users:
-        question.votes.update_or_create(user=request.user, defaults={"value": value})
-
-    # 2.用户已近赞过，要取消赞/踩一下
-    elif question.votes.get(user=request.user).value:
-        if value:
-            question.votes.get(user=request.user).delete()
-        else:
-            question.votes.update_or_create(user=request.user, defaults={"value": value})
-
-    # 3.用户已踩过，取消踩/赞一下
-    else:
-        if not value:
-            question.votes.get(user=request.user).delete()
-        else:
-            question.votes.update_or_create(user=request.user, defaults={"value": value})
-    """
-
-    return JsonResponse({"votes": question.total_votes()})
+    question = Question.objects.only('pk').get(pk=question_id)
+    # 点赞或踩一共五种情况（首次赞/踩、取消赞/踩、赞踩互换），由switch_vote在一个事务内完成
+    votes = Vote.objects.switch_vote(request.user, question, value)
+    return JsonResponse({"votes": votes})
 
 
 @login_required
@@ -137,15 +125,9 @@ def answer_vote(request):
     """给回答投票，AJAX POST请求"""
     answer_id = request.POST["answer"]
     value = True if request.POST["value"] == 'U' else False  # 'U'表示赞，'D'表示踩
-    answer = Answer.objects.get(uuid_id=answer_id)
-    users = answer.votes.values_list('user', flat=True)  # 当前回答的所有投票用户
-
-    if request.user.pk in users and (answer.votes.get(user=request.user).value == value):
-        answer.votes.get(user=request.user).delete()
-    else:
-        answer.votes.update_or_create(user=request.user, defaults={"value": value})
-
-    return JsonResponse({"votes": answer.total_votes()})
+    answer = Answer.objects.only('pk').get(uuid_id=answer_id)
+    votes = Vote.objects.switch_vote(request.user, answer, value)
+    return JsonResponse({"votes": votes})
 
 
 @login_required
@@ -160,6 +142,8 @@ def accept_answer(request):
     if answer.question.user.username != request.user.username:
         raise PermissionDenied
     answer.accept_answer()
-    # 接受回答后，通知文章作者
-    notification_handler(request.user, answer.user, 'W', answer)
+    # 接受回答后，一次批量通知该问题的所有回答者
+    answerers = Answer.objects.filter(question_id=answer.question_id).order_by().values_list(
+        'user_id', flat=True).distinct()
+    notify_many(request.user, answerers, 'W', answer)
     return JsonResponse({'status': 'true'})
@@ -15,6 +15,7 @@ $(function () {
             type: 'POST',
             success: function (data) {
                 $(".send-message").before(data);  // 将接收到的消息插入到聊天框
+                $(".read-receipt").text('');  // 新发送的消息对方还未读
                 $("input[name='message']").val(''); // 消息发送框置为空
                 scrollConversationScreen();  // 滚动条下拉到底
             }
@@ -22,18 +23,55 @@ $(function () {
         return false;
     });
 
-    // WebSocket连接，使用wss(https)或者ws(http)
+    // AJAX GET加载更早的消息，插入到聊天框顶部，并保持当前的滚动位置
+    $(".messages-list").on("click", ".load-older", function () {
+        const link = $(this);
+        const messagesList = $('.messages-list');
+        $.ajax({
+            url: link.data('url'),
+            data: {'cursor': link.data('cursor')},
+            cache: false,
+            type: 'GET',
+            success: function (data) {
+                const scrollHeight = messagesList[0].scrollHeight;
+                link.after(data.messages);
+                messagesList.scrollTop(messagesList.scrollTop() + messagesList[0].scrollHeight - scrollHeight);
+                if (data.next_cursor) {
+                    link.data('cursor', data.next_cursor);
+                } else {
+                    link.remove();
+                }
+            }
+        });
+        return false;
+    });
+
+    // WebSocket连接，使用wss(https)或者ws(http)，帧格式见socket.js
     const ws_scheme = window.location.protocol === "https:" ? "wss" : "ws";
     const ws_path = ws_scheme + "://" + window.location.host + "/ws/" + currentUser + "/";
-    const ws = new ReconnectingWebSocket(ws_path);
-    // 监听后端发送过来的消息
-    ws.onmessage = function (event) {
-        const data = JSON.parse(event.data);
-        if (data.sender === activeUser) {  // 发送者为当前选中的用户
-            $(".send-message").before(data.message); // 将接收到的消息插入到聊天框
-            scrollConversationScreen();  // 滚动条下拉到底
-        }
-    }
+    const socket = new ProtocolSocket(ws_path, {
+        // 监听后端发送过来的消息
+        onEvent: function (type, data) {
+            switch (type) {
+                case "message":
+                    if (data.sender === activeUser) {  // 发送者为当前选中的用户
+                        $(".send-message").before(data.message); // 将接收到的消息插入到聊天框
+                        scrollConversationScreen();  // 滚动条下拉到底
+                    }
+                    break;
+                // 已读回执
+                case "read":
+                    if (data.by === activeUser) {
+                        $(".read-receipt").text('对方已读');
+                    }
+                    break;
+            }
+        },
+        // 断线期间错过的私信无法补发，重新加载会话
+        onReset: function () {
+            window.location.reload();
+        },
+    });
 });
 
 /*
@@ -59,6 +59,7 @@ $(function () {
             cache: false,
             success: function (data) {
                 $("ul.stream").prepend(data);
+                window.subscribeNews($("ul.stream").children().first());
                 $("#newsInput").val("");
                 $("#newsFormModal").modal("hide");
                 hide_stream_update();
@@ -1,14 +1,13 @@
 $(function () {
-    const emptyMessage = '没有未读通知';
     const notice = $('#notifications');
 
     function CheckNotifications() {
         $.ajax({
-            url: '/notifications/latest-notifications/',
+            url: '/notifications/unread-count/',
             cache: false,
             success: function (data) {
                 // 有未读通知，把铃铛变为红色
-                if (!data.includes(emptyMessage)) {
+                if (data.count > 0) {
                     notice.addClass('btn-danger');
                 }
             },
@@ -16,19 +15,11 @@ $(function () {
     }
 
     CheckNotifications();  // 页面加载时执行
-    // 收到WS的数据后，若是social_update则获取该条动态的赞和评论数据 最新值
-    function update_social_activity(id_value) {
-        const newsToUpdate = $('[news-id=' + id_value + ']');
-        $.ajax({
-            url: '/news/update-interactions/',
-            data: {'id_value': id_value},
-            type: 'POST',
-            cache: false,
-            success: function (data) {
-                $(".like-count", newsToUpdate).text(data.likes);
-                $(".comment-count", newsToUpdate).text(data.comments);
-            },
-        });
+    // 收到WS的social_update后，用推送的最新值更新该条动态的赞和评论数
+    function update_social_activity(data) {
+        const newsToUpdate = $('[news-id=' + data.id_value + ']');
+        $(".like-count", newsToUpdate).text(data.likes);
+        $(".comment-count", newsToUpdate).text(data.comments);
     }
 
     // 通知铃铛的 点击事件
@@ -66,37 +57,61 @@ $(function () {
     const ws_scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
     // WS的routing ws_url路径
     const ws_path = ws_scheme + '://' + window.location.host + '/ws/notifications/';
-    // 创建WS实例
-    const ws = new ReconnectingWebSocket(ws_path);
 
-    // 监听后端发送过来的消息
-    ws.onmessage = function (event) {
-        // event.data 后端WebSocket 返回的数据，定义在视图的 payload字典 里
-        const data = JSON.parse(event.data);
-        // 通过关键字key 判断是那种通知
-        switch (data.key) {
+    // 订阅页面上显示的动态，只接收这些动态的点赞数、评论数变化；首页还订阅“有新动态”提示
+    function subscribeNews($items, feed) {
+        const ids = $items.map(function () {
+            return $(this).attr('news-id');
+        }).get();
+        if (ids.length || feed) {
+            socket.send('subscribe', {'feed': feed, 'news': ids});
+        }
+    }
+
+    window.subscribeNews = function ($items) {
+        subscribeNews($($items).find('[news-id]').addBack('[news-id]'), false);
+    };
+
+    // 合并后的事件可能来自多个用户，只要有一个不是自己就提示
+    function fromOthers(data) {
+        return data.actor_names.some(function (name) {
+            return name !== currentUser;
+        });
+    }
+
+    function handleEvent(type, data) {
+        // 通过事件类型判断是那种通知
+        switch (type) {
             case "notification":
-                if (currentUser !== data.actor_name) {  // 消息提示的发起者不提示
+                if (fromOthers(data)) {  // 消息提示的发起者不提示
                     notice.addClass('btn-danger');
                 }
                 break;
-            // 给动态点赞或评论
+            // 订阅的动态被点赞或评论
             case "social_update":
-                if (currentUser !== data.actor_name) {
-                    notice.addClass('btn-danger');
-                }
-                update_social_activity(data.id_value);
+                update_social_activity(data);
                 break;
             // 发表新动态
             case "additional_news":
-                if (currentUser !== data.actor_name) {
+                if (fromOthers(data)) {
                     $('.stream-update').show();
                 }
                 break;
 
             default:
-                console.log('error', data);
+                console.log('error', type, data);
                 break;
         }
-    };
+    }
+
+    // 创建WS实例，帧格式见socket.js
+    const socket = new ProtocolSocket(ws_path, {
+        // 每次(重新)连接后订阅当前页面上的全部动态
+        onOpen: function () {
+            subscribeNews($('[news-id]'), $('ul.stream').length > 0);
+        },
+        onEvent: handleEvent,
+        // 断线期间错过的通知无法补发，重新获取未读数
+        onReset: CheckNotifications,
+    });
 });
@@ -0,0 +1,66 @@
+// WebSocket消息协议（第1版）的客户端，帧格式见dquora/websocket.py
+// 处理心跳、批量帧、序号去重，断线重连后请求补发错过的事件
+function ProtocolSocket(path, options) {
+    const ws = new ReconnectingWebSocket(path);
+    let lastSeq = null;  // 已处理的可补发事件的最大序号
+
+    function send(type, data) {
+        if (ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({'v': 1, 't': type, 'd': data || {}}));
+        }
+    }
+
+    function dispatch(event) {
+        if (event.s !== undefined) {
+            if (lastSeq !== null && event.s <= lastSeq) {
+                return;  // 补发时重复收到的事件
+            }
+            if (lastSeq !== null && event.s > lastSeq + 1) {
+                send('hello', {'last_seq': lastSeq});  // 中间有事件丢失，请求补发
+                return;
+            }
+            lastSeq = event.s;
+        }
+        options.onEvent(event.t, event.d || {});
+    }
+
+    // 每次(重新)连接后告诉服务端已收到的最大序号
+    ws.onopen = function () {
+        send('hello', {'last_seq': lastSeq});
+        if (options.onOpen) {
+            options.onOpen();
+        }
+    };
+
+    ws.onmessage = function (message) {
+        const frame = JSON.parse(message.data);
+        if (frame.v !== 1) {
+            return;
+        }
+        switch (frame.t) {
+            case 'ping':
+                send('pong');
+                break;
+            case 'welcome':
+                if (lastSeq === null || frame.s > lastSeq) {
+                    lastSeq = frame.s;
+                }
+                break;
+            // 错过的事件无法补发，由页面重新获取状态
+            case 'reset':
+                lastSeq = frame.s;
+                if (options.onReset) {
+                    options.onReset();
+                }
+                break;
+            case 'batch':
+                frame.e.forEach(dispatch);
+                break;
+            default:
+                dispatch(frame);
+                break;
+        }
+    };
+
+    this.send = send;
+}
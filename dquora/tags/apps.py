@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+class TagsConfig(AppConfig):
+    name = 'dquora.tags'
+    verbose_name = '标签统计'
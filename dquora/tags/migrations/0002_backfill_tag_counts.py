@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:20
+
+from django.db import migrations
+from django.db.models import Count
+
+# (app_label, model, 计入统计的字段条件)，同各模型的register_tag_counts()
+COUNTED_MODELS = (
+    ('qa', 'question', {}),
+    ('articles', 'article', {'status': 'P'}),
+)
+
+
+def backfill_tag_counts(apps, schema_editor):
+    """根据已有的TaggedItem初始化标签统计，同TagCount.objects.rebuild()"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TagCount = apps.get_model('tags', 'TagCount')
+    for app_label, model_name, lookups in COUNTED_MODELS:
+        content_type = ContentType.objects.filter(app_label=app_label, model=model_name).first()
+        if content_type is None:
+            continue
+        queryset = apps.get_model(app_label, model_name).objects.filter(**lookups)
+        counts = TaggedItem.objects.filter(
+            content_type=content_type,
+            object_id__in=queryset.order_by().values('pk'),
+        ).values_list('tag_id').annotate(count=Count('pk')).order_by()
+        TagCount.objects.filter(content_type=content_type).delete()
+        TagCount.objects.bulk_create([TagCount(content_type=content_type, tag_id=tag_id, count=count)
+                                      for tag_id, count in counts], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0001_initial'),
+        ('qa', '0001_initial'),
+        ('articles', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_tag_counts, migrations.RunPython.noop),
+    ]
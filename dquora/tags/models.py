@@ -0,0 +1,138 @@
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Count
+from django.db.models.signals import m2m_changed, post_init, post_save, pre_delete
+from django.contrib.contenttypes.models import ContentType
+
+from taggit.models import Tag, TaggedItem
+
+# 参与标签统计的模型 -> 计入统计的字段条件，如文章只统计已发表的{'status': 'P'}
+counted_models = {}
+
+
+class TagCountQuerySet(models.query.QuerySet):
+    """自定义TagCount的QuerySet API"""
+
+    def popular(self, model, limit=None, min_count=1):
+        """某个模型的热门标签，走(content_type, count)索引，返回[(标签名, 数量), ...]"""
+        qs = self.filter(content_type=ContentType.objects.get_for_model(model), count__gte=min_count).order_by(
+            '-count', 'tag__name').values_list('tag__name', 'count')
+        if limit is not None:
+            qs = qs[:limit]
+        return list(qs)
+
+    def change(self, model, tag_ids, delta):
+        """给模型的若干标签的数量加上delta，标签第一次出现时新建统计行"""
+        content_type = ContentType.objects.get_for_model(model)
+        for tag_id in tag_ids:
+            qs = self.filter(content_type=content_type, tag_id=tag_id)
+            if qs.update(count=F('count') + delta) or delta < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(content_type=content_type, tag_id=tag_id, count=delta)
+            except IntegrityError:
+                # 并发时统计行已被其它请求创建，改为累加
+                qs.update(count=F('count') + delta)
+
+    def rebuild(self, model):
+        """根据TaggedItem重新统计某个模型的全部标签，用于定期校准增量计数的偏差"""
+        content_type = ContentType.objects.get_for_model(model)
+        queryset = model._default_manager.filter(**counted_models.get(model, {}))
+        counts = dict(TaggedItem.objects.filter(
+            content_type=content_type,
+            object_id__in=queryset.order_by().values('pk'),
+        ).values_list('tag_id').annotate(count=Count('pk')).order_by())
+        with transaction.atomic():
+            existing = {tag_count.tag_id: tag_count
+                        for tag_count in self.select_for_update().filter(content_type=content_type)}
+            self.filter(pk__in=[tag_count.pk for tag_id, tag_count in existing.items()
+                                if tag_id not in counts]).delete()
+            to_update = []
+            to_create = []
+            for tag_id, count in counts.items():
+                tag_count = existing.get(tag_id)
+                if tag_count is None:
+                    to_create.append(self.model(content_type=content_type, tag_id=tag_id, count=count))
+                elif tag_count.count != count:
+                    tag_count.count = count
+                    to_update.append(tag_count)
+            self.bulk_update(to_update, ['count'], batch_size=500)
+            self.bulk_create(to_create, batch_size=500)
+        return len(counts)
+
+
+class TagCount(models.Model):
+    """按模型（ContentType）物化的标签数量，由标签变化增量维护，Celery定期校准"""
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name='模型')
+    tag = models.ForeignKey(Tag, related_name='counts', on_delete=models.CASCADE, verbose_name='标签')
+    count = models.IntegerField(default=0, verbose_name='数量')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    objects = TagCountQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '标签统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('content_type', 'tag')
+        index_together = ('content_type', 'count')  # 热门标签按数量排序
+
+    def __str__(self):
+        return f'{self.tag} ({self.count})'
+
+
+def register_tag_counts(model, **lookups):
+    """
+    将带TaggableManager的模型加入标签统计
+    :param model:   模型类，如Question
+    :param lookups: 计入统计的对象需要满足的字段值，如status='P'，不传表示全部计入
+    """
+    counted_models[model] = lookups
+    uid = f'tag_counts_{model._meta.label_lower}'
+    if lookups:
+        post_init.connect(receiver=_object_post_init, sender=model, dispatch_uid=uid)
+        post_save.connect(receiver=_object_post_save, sender=model, dispatch_uid=uid)
+    pre_delete.connect(receiver=_object_pre_delete, sender=model, dispatch_uid=uid)
+
+
+def _is_counted(instance):
+    """根据对象自身的字段值判断是否计入标签统计，不查询数据库"""
+    return all(getattr(instance, field) == value for field, value in counted_models[type(instance)].items())
+
+
+def _tag_ids(instance):
+    return TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(instance),
+                                     object_id=instance.pk).values_list('tag_id', flat=True)
+
+
+def _tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """对象增删标签时增量更新统计"""
+    model = type(instance)
+    if reverse or model not in counted_models:
+        return
+    if action in ('post_add', 'post_remove') and pk_set and _is_counted(instance):
+        TagCount.objects.change(model, pk_set, 1 if action == 'post_add' else -1)
+    elif action == 'pre_clear' and _is_counted(instance):
+        TagCount.objects.change(model, list(_tag_ids(instance)), -1)
+
+
+def _object_post_init(sender, instance, **kwargs):
+    # 记录加载时是否计入统计，保存时据此判断状态是否变化（如文章从草稿变为发表）
+    # 延迟加载了条件字段时不记录，避免在初始化时触发查询，偏差由定期校准修正
+    if all(field in instance.__dict__ for field in counted_models[sender]):
+        instance._tag_counted = _is_counted(instance)
+
+
+def _object_post_save(sender, instance, created, **kwargs):
+    counted = _is_counted(instance)
+    # 新建对象此时还没有标签，无需更新统计
+    if not created and counted != getattr(instance, '_tag_counted', counted):
+        TagCount.objects.change(sender, list(_tag_ids(instance)), 1 if counted else -1)
+    instance._tag_counted = counted
+
+
+def _object_pre_delete(sender, instance, **kwargs):
+    # 对象删除时其TaggedItem被级联删除，不会发出m2m_changed信号
+    if _is_counted(instance):
+        TagCount.objects.change(sender, list(_tag_ids(instance)), -1)
+
+
+m2m_changed.connect(receiver=_tags_changed, sender=TaggedItem)
@@ -0,0 +1,50 @@
+import pytest
+
+from dquora.articles.models import Article
+from dquora.qa.models import Question
+from dquora.tags.models import TagCount
+from dquora.taskapp.tasks import reconcile_tag_counts
+
+pytestmark = pytest.mark.django_db
+
+
+def test_article_tags_counted_only_while_published(user):
+    article = Article.objects.create(user=user, title='草稿', content='内容', image='articles_pictures/a.jpg')
+    article.tags.add('python', 'django')
+    assert TagCount.objects.popular(Article) == []
+
+    article = Article.objects.get(pk=article.pk)
+    article.status = 'P'
+    article.save()
+    assert TagCount.objects.popular(Article) == [('django', 1), ('python', 1)]
+
+    # 发表后改回草稿，其标签不再计入
+    article.status = 'D'
+    article.save()
+    assert TagCount.objects.popular(Article) == []
+
+
+def test_question_tag_removal_and_delete(user):
+    first = Question.objects.create(user=user, title='问题一', content='内容')
+    second = Question.objects.create(user=user, title='问题二', content='内容')
+    first.tags.add('python', 'django')
+    second.tags.add('python', 'go')
+    assert TagCount.objects.popular(Question) == [('python', 2), ('django', 1), ('go', 1)]
+    assert TagCount.objects.popular(Question, limit=1) == [('python', 2)]
+    assert TagCount.objects.popular(Question, min_count=2) == [('python', 2)]
+
+    first.tags.remove('django')
+    second.tags.clear()
+    assert TagCount.objects.popular(Question) == [('python', 1)]
+
+    first.delete()
+    assert TagCount.objects.popular(Question) == []
+
+
+def test_reconcile_fixes_drifted_counts(user):
+    question = Question.objects.create(user=user, title='问题', content='内容')
+    question.tags.add('python')
+    TagCount.objects.update(count=7)
+
+    reconcile_tag_counts()
+    assert TagCount.objects.popular(Question) == [('python', 1)]
@@ -0,0 +1,8 @@
+from dquora.taskapp.celery import app
+from dquora.tags.models import TagCount, counted_models
+
+
+@app.task()
+def reconcile_tag_counts():
+    """定期根据TaggedItem重新统计各模型的标签数量，修正增量计数的偏差"""
+    return {model._meta.label_lower: TagCount.objects.rebuild(model) for model in counted_models}
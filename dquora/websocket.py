@@ -0,0 +1,166 @@
+"""
+WebSocket消息协议（第1版），NotificationsConsumer和MessagesConsumer共用
+
+服务端发往客户端的帧，JSON，键名尽量短：
+    {"v": 1, "t": "<事件类型>", "s": <序号>, "d": {...}}    单个事件，s只有可补发的事件才有
+    {"v": 1, "t": "batch", "e": [{"t":..., "s":..., "d":...}, ...]}    一帧多个事件
+    {"v": 1, "t": "ping"}                                    心跳，客户端回复pong
+    {"v": 1, "t": "welcome", "s": <当前序号>}                 回复hello
+    {"v": 1, "t": "reset", "s": <当前序号>}                   错过的事件无法补齐，客户端需重新获取状态
+客户端发往服务端的帧：
+    {"v": 1, "t": "hello", "d": {"last_seq": <已收到的最大序号或null>}}    (重新)连接后发送
+    {"v": 1, "t": "pong"}
+    其他类型交给consumer的handle_event()处理
+
+发给用户自己的事件（通知、私信、已读回执）是可补发的：发布时按组分配递增的序号并在缓存中保留一段时间，
+客户端断线重连（如daphne重启）后用hello带上已收到的最大序号，服务端补发之后的事件，不需要刷新页面。
+"""
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+HEARTBEAT_INTERVAL = 25  # 服务端发送ping的间隔（秒），小于常见代理60秒的空闲超时
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL  # 这么久没有收到客户端的任何帧就断开连接
+BACKLOG_SIZE = 100  # 每个组最多补发的事件数
+BACKLOG_TIMEOUT = 10 * 60  # 可补发事件在缓存中保留的时间（秒）
+
+
+def encode_frame(frame):
+    return json.dumps(dict(frame, v=PROTOCOL_VERSION), ensure_ascii=False, separators=(',', ':'))
+
+
+def _seq_key(group):
+    return f'ws:seq:{group}'
+
+
+def _event_key(group, seq):
+    return f'ws:event:{group}:{seq}'
+
+
+def make_event(group, event_type, data, resumable=False):
+    """
+    生成一个协议事件，可补发的事件分配该组的下一个序号并保存到缓存中
+    :param group:       频道层的组名，可补发事件的序号按组递增
+    :param event_type:  事件类型，对应帧中的t
+    :param data:        dict 事件数据，对应帧中的d
+    :param resumable:   是否可补发
+    """
+    event = {'t': event_type, 'd': data}
+    if resumable:
+        cache.add(_seq_key(group), 0, None)
+        try:
+            seq = cache.incr(_seq_key(group))
+        except ValueError:  # 缓存被清空
+            seq = 1
+            cache.set(_seq_key(group), seq, None)
+        event['s'] = seq
+        cache.set(_event_key(group, seq), event, BACKLOG_TIMEOUT)
+    return event
+
+
+def current_seq(group):
+    return cache.get(_seq_key(group)) or 0
+
+
+def replay_events(group, last_seq):
+    """
+    取出last_seq之后的可补发事件
+    :return: (事件列表, 当前序号)，无法补齐（超出BACKLOG_SIZE、已过期或服务端序号已重置）时事件列表为None
+    """
+    seq = current_seq(group)
+    if last_seq > seq or seq - last_seq > BACKLOG_SIZE:
+        return None, seq
+    keys = [_event_key(group, s) for s in range(last_seq + 1, seq + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None, seq
+    return [found[key] for key in keys], seq
+
+
+def publish(group, events):
+    """把一组协议事件作为一条消息发到频道层的组，由ProtocolConsumer.events()转发"""
+    async_to_sync(get_channel_layer().group_send)(group, {'type': 'events', 'events': events})
+
+
+class ProtocolConsumer(AsyncWebsocketConsumer):
+    """
+    实现上述协议的consumer基类：批量转发事件、心跳、断线重连后补发
+    子类在connect()中设置self.stream（可补发事件所在的组）后调用start_protocol()
+    """
+    stream = None
+
+    async def start_protocol(self):
+        self.last_seen = time.monotonic()
+        self.heartbeat = asyncio.ensure_future(self.send_heartbeats())
+
+    async def send_heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > HEARTBEAT_TIMEOUT:
+                await self.close()
+                return
+            await self.send(text_data=encode_frame({'t': 'ping'}))
+
+    async def send_events(self, events):
+        """一个事件单独一帧，多个事件合并为一帧"""
+        if len(events) == 1:
+            await self.send(text_data=encode_frame(events[0]))
+        elif events:
+            await self.send(text_data=encode_frame({'t': 'batch', 'e': events}))
+
+    async def events(self, message):
+        """频道层发来的事件（type为events），见publish()"""
+        await self.send_events(message['events'])
+
+    async def receive(self, text_data=None, bytes_data=None):
+        self.last_seen = time.monotonic()
+        try:
+            frame = json.loads(text_data)
+            event_type, data = frame['t'], frame.get('d') or {}
+        except (TypeError, ValueError, KeyError):
+            return
+        if not isinstance(data, dict):
+            return  # 格式错误的帧直接丢弃，不能让异常结束consumer
+        if event_type == 'hello':
+            await self.resume(data.get('last_seq'))
+        elif event_type != 'pong':
+            await self.handle_event(event_type, data)
+
+    async def resume(self, last_seq):
+        """客户端(重新)连接：补发last_seq之后的事件，首次连接时只告知当前序号"""
+        if self.stream is None:
+            return
+        if not isinstance(last_seq, int):
+            seq = await sync_to_async(current_seq)(self.stream)
+            await self.send(text_data=encode_frame({'t': 'welcome', 's': seq}))
+            return
+        events, seq = await sync_to_async(replay_events)(self.stream, last_seq)
+        if events is None:
+            await self.send(text_data=encode_frame({'t': 'reset', 's': seq}))
+        else:
+            await self.send_events(events)
+            await self.send(text_data=encode_frame({'t': 'welcome', 's': seq}))
+
+    async def handle_event(self, event_type, data):
+        """子类处理客户端发来的其他类型的帧"""
+
+    async def disconnect(self, code):
+        heartbeat = getattr(self, 'heartbeat', None)
+        if heartbeat is not None:
+            # 取消并等待心跳协程结束。它抛出的异常只记录日志，不能让子类跳过离开组等清理工作
+            heartbeat.cancel()
+            try:
+                await heartbeat
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception('WebSocket心跳异常结束: %s', self.channel_name)